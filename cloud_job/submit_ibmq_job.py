@@ -37,6 +37,8 @@ from qiskit import qpy
         
 sys.path.append(os.path.abspath("/qcrank_light"))
 from datacircuits.ParametricQCrankV2 import  ParametricQCrankV2 as QCrankV2, qcrank_reco_from_yields
+from datacircuits.cache import transpile_cached
+from datacircuits import sim, emit
 
 
 import argparse
@@ -54,12 +56,14 @@ def commandline_parser(backName="aer_ideal",provName="local_sim"):
     parser.add_argument("--useCZ", action='store_true', default=False, help="change from CX to CZ entangelemnt")
     parser.add_argument("--mockCirc", action='store_true', default=False, help="changes Ry to make circ look nice but non-executable")
     parser.add_argument("-A","--add1M1data", action='store_true', default=False, help="append circ w/ +1,-1, pattern along num_addr")
+    parser.add_argument('--precision', default='float64', choices=['float64','float32'], help="dtype of angles and stored inp/rec data, float32 halves memory")
 
 
     # .... job running
     parser.add_argument('-n','--numShot',type=int,default=2000, help="shots per circuit")
     parser.add_argument('-b','--backend',default=backName, help="tasks")
     parser.add_argument('--transpSeed',default=42, type=int, help="random seed for transpiler")
+    parser.add_argument( "--noTranspCache", action='store_true', default=False, help="always re-run the transpiler, bypass the on-disk transpilation cache")
     parser.add_argument( "--useRC", action='store_true', default=False, help="enable randomized compilation , HW only ")
     parser.add_argument( "--useDD", action='store_true', default=False, help="enable Dynamical Decoupling , HW only ")
 
@@ -68,9 +72,11 @@ def commandline_parser(backName="aer_ideal",provName="local_sim"):
     parser.add_argument( "-E","--executeCircuit", action='store_true', default=False, help="may take long time, test before use ")
     parser.add_argument( "-e1","--exportQPY1", action='store_true', default=False, help="exprort parametrized circuit as QPY")
     parser.add_argument( "-e2","--exportQPY2", action='store_true', default=False, help="exprort binded circuit w/ meta as QPY and metaData")
+    parser.add_argument( "-e3","--exportQASM3", action='store_true', default=False, help="stream parametrized circuit as QASM3 w/o building it, for large nq_addr")
  
     '''there are 3 types of backend
     - run by local Aer:  ideal  or  fake_kyoto
+    - analytic_ideal: exact probabilities + multinomial shots, no simulator
     - submitted to IBM: ibm_kyoto
     '''
 
@@ -93,6 +99,13 @@ def M_export_qpy_parm(qc):
         qpy.dump(qc, fd)
     print('\nSaved 1 circ:',circF)
 
+#...!...!....................
+def M_export_qasm3_parm(args):
+    nq_addr,nq_data=args.numQubits
+    circF='out/qcrank_nqa%d_nqd%d_param.qasm'%(nq_addr,nq_data)
+    emit.write_qasm3(circF,nq_addr,nq_data,measure='reversed',use_cz=args.useCZ,barrier=not args.noBarrier)
+    print('\nSaved 1 circ:',circF)
+
 #...!...!....................
 def M_export_qpy_bound():
     inpData=expD['inp_udata']
@@ -122,6 +135,7 @@ def buildPayloadMeta(args):
     pd['seq_len']=pd['nq_data']*pd['num_addr']
     pd['rnd_seed']=args.rndSeed
     pd['cal_1M1']=args.add1M1data
+    pd['precision']=args.precision
     sbm={}
     sbm['num_shots']=args.numShot
     pom={}
@@ -168,6 +182,7 @@ def harvest_submitMeta(job_id,md,args):
         if args.provider=="local_sim":
             tag=args.backend.split('_')[1]
             if 'fake' in args.backend: tag='fake_'+tag
+            if 'analytic' in args.backend: tag='analytic'
         md['short_name']='%s_%s'%(tag,md['hash'])
     else:
         myHN=hashlib.md5(os.urandom(32)).hexdigest()[:6]
@@ -195,7 +210,7 @@ def construct_random_inputs(md,verb=1, seed=None):
         
     if verb>2:
         print('input data.T=',data_inp.shape,repr(data_inp.T))
-    bigD={'inp_udata': data_inp}
+    bigD={'inp_udata': data_inp.astype(pmd.get('precision','float64'))}
     return bigD
 
 
@@ -239,10 +254,28 @@ def harvest_sampler_results(job,md,bigD,T0=None):  # many circuits
     
     print('job QA'); pprint(qa)
     md['job_qa']=qa
-    bigD['rec_udata'], bigD['rec_udata_err'] =  qcrank_reco_from_yields(countsL,pmd['nq_addr'],pmd['nq_data'])
+    bigD['rec_udata'], bigD['rec_udata_err'] =  qcrank_reco_from_yields(countsL,pmd['nq_addr'],pmd['nq_data'],dtype=pmd.get('precision','float64'))
     #print('rec2 data.T',bigD['rec_udata'].T)
     return bigD
 
+#...!...!....................
+def harvest_analytic_results(countsL,md,bigD,T0):  # exact distribution sampled w/o simulator
+    pmd=md['payload']
+    qa={}
+    elaT=time()-T0
+    print(' job done, elaT=%.1f min'%(elaT/60.))
+    qa['running_duration']=elaT
+    qa['timestamp_running'] = '%.1g'%(elaT)
+    qa['status']='JobStatus.DONE'
+    qa['num_circ']=len(countsL)
+    qa['shots']=md['submit']['num_shots']
+    qa['num_clbits']=pmd['num_qubit']
+
+    print('job QA'); pprint(qa)
+    md['job_qa']=qa
+    bigD['rec_udata'], bigD['rec_udata_err'] =  qcrank_reco_from_yields(countsL,pmd['nq_addr'],pmd['nq_data'],dtype=pmd.get('precision','float64'))
+    return bigD
+
 
 #=================================
 #=================================
@@ -261,8 +294,9 @@ if __name__ == "__main__":
     
     # generate parametric circuit
     nq_addr, nq_data = args.numQubits
+    if args.exportQASM3: M_export_qasm3_parm(args); exit(0)  # constant memory, no QuantumCircuit
     
-    qcrankObj = QCrankV2( nq_addr, nq_data, useCZ=args.useCZ,measure=True,barrier=not args.noBarrier, mockCirc=args.mockCirc )
+    qcrankObj = QCrankV2( nq_addr, nq_data, useCZ=args.useCZ,measure=True,barrier=not args.noBarrier, mockCirc=args.mockCirc, dtype=args.precision )
         
     qcP=qcrankObj.circuit
     cxDepth=qcP.depth(filter_function=lambda x: x.operation.name == 'cx')
@@ -278,6 +312,7 @@ if __name__ == "__main__":
     # ------  construct sampler(.) job ------
     runLocal=True  # ideal or fake backend
     outPath=os.path.join(args.basePath,'meas') 
+    analytic= args.backend=='analytic_ideal'
     if 'ideal' in args.backend:
         assert not args.useRC
         qcT=qcP
@@ -308,7 +343,8 @@ if __name__ == "__main__":
                 print('seed=%d  qubits=%s '%(seed,layout))
             exit(0)
 
-        qcT =  transpile(qcP, backend,optimization_level=3, seed_transpiler=args.transpSeed)
+        # transpiled parametric circuit is reused across submissions, see datacircuits.cache
+        qcT =  transpile_cached(qcP, backend, enabled=not args.noTranspCache, optimization_level=3, seed_transpiler=args.transpSeed)
         qcrankObj.circuit=qcT  # pass transpiled parametric circuit back
         cxDepth=qcT.depth(filter_function=lambda x: x.operation.name == 'cz')
         print('.... PARAMETRIZED Transpiled (%s) CIRCUIT .............., cx-depth=%d'%(backend.name,cxDepth))
@@ -318,21 +354,22 @@ if __name__ == "__main__":
         
     circ_depth_aziz(qcP,'ideal')
     circ_depth_aziz(qcT,'transpiled')
-    harvest_circ_transpMeta(qcT,expMD,backend.name)
-    print('M: run on backend:',backend.name,outPath)
+    backN= args.backend if analytic else backend.name
+    harvest_circ_transpMeta(qcT,expMD,backN)
+    print('M: run on backend:',backN,outPath)
     assert os.path.exists(outPath)
    
     # -------- bind the data to parametrized circuit  -------
     qcrankObj.bind_data(expD['inp_udata'])
     
-    # generate the instantiated circuits
-    qcEL = qcrankObj.instantiate_circuits()
-    nCirc=len(qcEL)
-    if args.verb>2 :
+    # generate the instantiated circuits, the analytic backend needs none
+    qcEL = [] if analytic else qcrankObj.instantiate_circuits()
+    nCirc=qcrankObj.angles.shape[2]
+    if args.verb>2 and not analytic:
         print(f'.... FIRST INSTANTIATED CIRCUIT .............. of {nCirc}')
         print(qcEL[0].draw('text', idle_wires=False))
         
-    print('M: execution-ready %d circuits with %d qubits backend=%s'%(nCirc,nqTot,backend.name))
+    print('M: execution-ready %d circuits with %d qubits backend=%s'%(nCirc,nqTot,backN))
         
     if not args.executeCircuit:
         pprint(expMD)
@@ -341,7 +378,20 @@ if __name__ == "__main__":
         
     # ----- submission ----------
     numShots=expMD['submit']['num_shots']
-    print('M:job starting, nCirc=%d  nq=%d  shots/circ=%d at %s  ...'%(nCirc,qcEL[0].num_qubits,numShots,args.backend),backend)
+    print('M:job starting, nCirc=%d  nq=%d  shots/circ=%d at %s  ...'%(nCirc,nqTot,numShots,args.backend),backN)
+
+    if analytic:  # exact distribution + multinomial shots, seeded by --rndSeed
+        T0=time()
+        probs=sim.encoder_distribution(qcrankObj)
+        countsL=sim.sample_counts(probs,numShots,rng=args.rndSeed)
+        harvest_submitMeta(hashlib.md5(os.urandom(32)).hexdigest(),expMD,args)
+        harvest_analytic_results(countsL,expMD,expD,T0)
+        print('M: got results')
+        outF=os.path.join(outPath,expMD['short_name']+'.meas.h5')
+        write4_data_hdf5(expD,outF,expMD)
+        print('\n  basePath=%s'%args.basePath)
+        print('  ./postproc_qcrank.py  --basePath  $basePath  --expName   %s   -p a    -Y\n'%(expMD['short_name']))
+        exit(0)
    
     options = SamplerOptions()
     options.default_shots=numShots
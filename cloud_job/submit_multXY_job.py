@@ -40,6 +40,7 @@ from qiskit import QuantumCircuit, QuantumRegister, ClassicalRegister
 
 sys.path.append(os.path.abspath("/qcrank_light"))
 from datacircuits.ParametricQCrankV2 import  ParametricQCrankV2 as QCrankV2, qcrank_reco_from_yields
+from datacircuits.cache import transpile_cached
 
 
 import argparse
@@ -60,6 +61,7 @@ def commandline_parser(backName="aer_ideal",provName="local_sim"):
     parser.add_argument('-n','--numShot',type=int,default=50_000, help="shots per circuit")
     parser.add_argument('-b','--backend',default=backName, help="tasks")
     parser.add_argument('--transpSeed',default=42, type=int, help="random seed for transpiler")
+    parser.add_argument( "--noTranspCache", action='store_true', default=False, help="always re-run the transpiler, bypass the on-disk transpilation cache")
     parser.add_argument( "--useRC", action='store_true', default=False, help="enable randomized compilation , HW only ")
     parser.add_argument( "--useDD", action='store_true', default=False, help="enable Dynamical Decoupling , HW only ")
 
@@ -320,7 +322,8 @@ if __name__ == "__main__":
                 print('seed=%d  qubits=%s '%(seed,layout))
             exit(0)
 
-        qcT =  transpile(qcP, backend,optimization_level=3, seed_transpiler=args.transpSeed)
+        # transpiled parametric circuit is reused across submissions, see datacircuits.cache
+        qcT =  transpile_cached(qcP, backend, enabled=not args.noTranspCache, optimization_level=3, seed_transpiler=args.transpSeed)
         qcrankObj.circuit=qcT  # pass transpiled parametric circuit back
         cxDepth=qcT.depth(filter_function=lambda x: x.operation.name == 'cz')
         print('.... PARAMETRIZED Transpiled (%s) CIRCUIT .............., cx-depth=%d'%(backend.name,cxDepth))
@@ -77,8 +77,8 @@ def qasm_save_all_circ(qcL,md,bigD,args):
 
     nCirc=len(qcL)
     outA=np.empty((nCirc), dtype='object')
-    for ic in range(nCirc):
-        outA[ic]=qcL[ic].qasm()
+    for ic in range(nCirc):  # QASM text from datacircuits.emit is stored as is
+        outA[ic]=qcL[ic] if isinstance(qcL[ic],str) else qcL[ic].qasm()
     bigD['circ_qasm']=outA
     outF=os.path.join(args.outPath,md['short_name']+'.qasm.h5')
     write4_data_hdf5(bigD,outF,md)
@@ -42,6 +42,8 @@ from qiskit.result.utils import marginal_distribution
 
 sys.path.append(os.path.abspath("/qcrank_light"))
 from datacircuits import qcrank
+from datacircuits._util import resolve_dtype, parameter_table, rotation_angles
+from datacircuits.cache import cached_template, parameter_vectors
 
 #...!...!....................
 def print_latex(circ):
@@ -62,7 +64,9 @@ class ParametricQCrankV2():
                  barrier: bool = True,
                  useCZ: bool =  False,  # default uses CX gates
                  mockCirc: bool = False, # Ry arg is left out and Latex vesion is printed to stdout
-                 addressH: bool =True  # applies Hadamard on address qubits
+                 addressH: bool =True,  # applies Hadamard on address qubits
+                 dtype=None,  # float32 or float64 angles, None: package default
+                 useCache: bool = False  # load parametric circuit from on-disk template cache
                  ):
         '''Initializes a parametrized QCRANK circuit with nq_addr address qubits and
         nq_data data qubits. The total number of qubits in the circuit is nq_addr + nq_data.
@@ -76,6 +80,11 @@ class ParametricQCrankV2():
                 If True, adds measurements to all qubits.
             barrier: bool (True)
                 If True, inserts a barrier in the circuit.
+            dtype: (None)
+                float32 or float64 precision of the bound angles, package default if None.
+            useCache: bool (False)
+                If True, loads the parametric circuit from the on-disk template cache
+                (see datacircuits.cache), building and storing it on a miss.
         '''
         
         # Sanity check: ensure at least one address-data qubit pair exists
@@ -84,16 +93,62 @@ class ParametricQCrankV2():
         self.nq_addr = nq_addr
         self.nq_data = nq_data
         self.num_addr = 2 ** nq_addr
+        self.dtype = resolve_dtype(dtype)
         
-        # Create a parameter vector for each data qubit, each with 2**nq_addr parameters
-        self.parV = [   ParameterVector(f'p{i}', 2 ** nq_addr) for i in range(nq_data) ]
+        num_q=nq_addr + nq_data
+        # Control qubits of all CX gates, shift jd % nq_addr for data qubit jd
+        self.cnot_schedule = qcrank.CnotSchedule(nq_addr, [jd % nq_addr for jd in range(nq_addr,num_q)])
+
+        self.buildArgs = (measure, barrier, useCZ, mockCirc, addressH)
+        self.useCache = useCache
+        # Without the cache the parametric circuit is built on first use, build_bound() does not need it
+        self._circuit = None
+        self._parV = None
+        if useCache: self.circuit  # load or store the template up front
+
+#...!...!....................
+    @property
+    def circuit(self):
+        '''The parametric circuit.'''
+        if self._circuit is None:
+            measure, barrier, useCZ, mockCirc, addressH = self.buildArgs
+            buildF=lambda: self._build_circuit(*self.buildArgs)
+            # mock circuits are never cached, their Ry gates are placeholders
+            self._circuit = cached_template(ParametricQCrankV2, buildF, enabled=self.useCache and not mockCirc,
+                                            nq_addr=self.nq_addr, nq_data=self.nq_data, measure=measure,
+                                            barrier=barrier, useCZ=useCZ, addressH=addressH)
+        return self._circuit
+
+    @circuit.setter
+    def circuit(self, circ):
+        self._circuit = circ
+
+#...!...!....................
+    @property
+    def parV(self):
+        '''Parameter vectors, re-attached from the circuit if it was cached.'''
+        if self._parV is None:
+            parD = parameter_vectors(self.circuit)
+            self._parV = [ parD[f'p{i}'] for i in range(self.nq_data) ]
+        return self._parV
+
+#...!...!....................
+    def _build_circuit(self, measure, barrier, useCZ, mockCirc, addressH, angles=None):
+        '''Builds the circuit gate by gate: the parametric circuit, or the bound circuit with
+        numeric Ry angles if angles of shape (num_addr, nq_data) are given.'''
+        nq_addr, nq_data, num_addr = self.nq_addr, self.nq_data, self.num_addr
+        num_q=nq_addr + nq_data
+        if angles is None:
+            # Create a parameter vector for each data qubit, each with 2**nq_addr parameters
+            parV = [   ParameterVector(f'p{i}', 2 ** nq_addr) for i in range(nq_data) ]
+        else:  # plain floats, one list per data qubit
+            parV = np.asarray(angles).T.tolist()
         
         # Generate circuit
-        num_q=nq_addr + nq_data
         if measure:
-            self.circuit = QuantumCircuit(num_q,num_q)
+            qc = QuantumCircuit(num_q,num_q)
         else:  # only qubit wires, no classical wires
-            self.circuit = QuantumCircuit(num_q)
+            qc = QuantumCircuit(num_q)
        
         if mockCirc: 
             from qiskit.quantum_info import Operator
@@ -108,38 +163,41 @@ class ParametricQCrankV2():
             QuantumCircuit.ry = mockRy            
             
         if addressH:        # Apply Hadamard gates (diffusion) to all address qubits
-            for i in range(nq_addr):   self.circuit.h(i)
-            if barrier:   self.circuit.barrier()
+            for i in range(nq_addr):   qc.h(i)
+            if barrier:   qc.barrier()
       
         if useCZ:  # will use CZ entangling gates
-            for jd in range(nq_addr,num_q):   self.circuit.h( jd)
+            for jd in range(nq_addr,num_q):   qc.h( jd)
                        
+        ctrlL = self.cnot_schedule.controls.tolist()  # control qubits of all CX gates
+
         # Add nested and shifted uniform rotations along with controlled-X (CX) gates
-        for ja in range(self.num_addr):
+        for ja in range(num_addr):
            
             for jd in range(nq_addr,num_q):
-                pars=self.parV[jd-nq_addr][ja]
-                self.circuit.ry(pars, jd)
+                pars=parV[jd-nq_addr][ja]
+                qc.ry(pars, jd)
                         
             for jd in range(nq_addr,num_q):
-                qctr = qcrank.compute_control(ja, self.nq_addr, shift=jd % nq_addr)
+                qctr = ctrlL[ja][jd-nq_addr]
                 if useCZ:
-                    self.circuit.cz(qctr, jd)
+                    qc.cz(qctr, jd)
                 else:
-                    self.circuit.cx(qctr, jd)
+                    qc.cx(qctr, jd)
 
         if useCZ :  # will use CZ entangling gates
-            for jd in range(nq_addr,num_q):   self.circuit.h( jd)                
+            for jd in range(nq_addr,num_q):   qc.h( jd)                
 
         if measure:
-            if barrier: self.circuit.barrier()
+            if barrier: qc.barrier()
             for i in range(num_q):
                 j=num_q-1-i  # Reverse qubit order to match Qiskit's little-endian convention
-                self.circuit.measure(i,j)
-        if  mockCirc: print_latex(self.circuit)
+                qc.measure(i,j)
+        if  mockCirc: print_latex(qc)
+        return qc
             
 #...!...!....................
-    def bind_data(self, data):
+    def bind_data(self, data, workers=None):
         '''Binds input data to the parametrized QCRANK circuit.
 
         Args:
@@ -148,11 +206,16 @@ class ParametricQCrankV2():
                   * A numpy array of shape (2**nq_addr, nq_data)
                   * A list of numpy arrays of shape (2**nq_addr, nq_data)
                   * A numpy array of shape (2**nq_addr, nq_data, k)
+                A memory-mapped array is used as is, without copying.
+            workers: int (None)
+                Number of processes for transforming very large batches, see rotation_angles.
         '''
         if not isinstance(data, (np.ndarray, list)):
             raise RuntimeError('data should be either a numpy array or a list of numpy arrays, '
                                f'got {isinstance(data)}')
 
+        if isinstance(data, list):
+            data = np.stack(data, axis=2)
         if isinstance(data, np.ndarray) and data.ndim == 2:
             data = data[..., np.newaxis]
 
@@ -167,12 +230,10 @@ class ParametricQCrankV2():
                 '[(2**nq_addr, nq_data, k)]'
             )
         self.data = data
-        self.angles = np.arccos(data)
-        self.angles_qcrank = np.empty(self.angles.shape)
-        for r in range(self.angles.shape[1]):
-            self.angles_qcrank[:, r] = qcrank.shifted_gray_permutation(
-                qcrank.sfwht(self.angles[:, r]),  r % self.nq_addr
-            )
+        self.angles = np.arccos(data, dtype=self.dtype)
+        # all data qubits and images in one batched transform
+        self.angles_qcrank = rotation_angles(self.angles, self.cnot_schedule.shifts,
+                                             dtype=self.dtype, workers=workers)
 
 #...!...!....................
     def instantiate_circuits(self,mult=1.):
@@ -189,19 +250,40 @@ class ParametricQCrankV2():
             circs.append(circ)
         return circs
 
+#...!...!....................
+    def build_bound(self, data, mult=1., workers=None):
+        '''Binds the data and builds the circuits with numeric Ry angles, skipping the
+        parameter vectors and assign_parameters. Same gates as instantiate_circuits(mult),
+        meant for data encoded only once.'''
+        self.bind_data(data, workers=workers)
+        return [ self._build_circuit(*self.buildArgs, angles=mult*self.angles_qcrank[:, :, j])
+                 for j in range(self.angles_qcrank.shape[2]) ]
+
+#...!...!....................
+    def parameter_table(self,mult=1.):
+        '''Returns the parametric circuit and a (k, num_parameters) table of the bound angles,
+        ordered like circuit.parameters. Use it as a SamplerV2 PUB (circuit, table) instead
+        of k instantiated circuits.'''
+        if self.angles_qcrank is None:
+            raise RuntimeError('Parametrized QCRANKV2 circuit has not been bound to data. '
+                               'Run the `bind_data` method first.')
+        return self.circuit, parameter_table(self.circuit.parameters, self.parV, mult*self.angles_qcrank)
+
 #...!...!....................
     def reco_from_yields(self, countsL):
-        return qcrank_reco_from_yields( countsL,self.nq_addr,self.nq_data )
+        return qcrank_reco_from_yields( countsL,self.nq_addr,self.nq_data, dtype=self.dtype )
 
 
 # - - - - - - -  UTILITY function - - - - - - -
 
 #...!...!....................
-def qcrank_reco_from_yields( countsL,nq_addr,nq_data):
+def qcrank_reco_from_yields( countsL,nq_addr,nq_data, dtype=None):
         '''Reconstructs data from measurement counts.
         Args:
             countsL: list
                 List of measurement counts from the instantiated circuits.        
+            dtype: (None)
+                float32 or float64 precision of the output, package default if None.
         Returns:
             rec_udata: numpy array
                 Reconstructed un-normalized data with shape 
@@ -211,7 +293,7 @@ def qcrank_reco_from_yields( countsL,nq_addr,nq_data):
         print('QRFY: nq_addr,nq_data=',nq_addr,nq_data,' addrBitsL:',addrBitsL)
         nCirc = len(countsL)
         num_addr=1<<nq_addr
-        rec_udata = np.zeros((num_addr, nq_data, nCirc))  # To match input indexing
+        rec_udata = np.zeros((num_addr, nq_data, nCirc), dtype=resolve_dtype(dtype))  # To match input indexing
         rec_udataErr = np.zeros_like(rec_udata)       
         for ic in range(nCirc):
             counts = countsL[ic]
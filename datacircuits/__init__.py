@@ -2,9 +2,19 @@
 # -*- coding: utf-8 -*-
 """Data Encoder Circuits Library"""
 from ._version import __version__
+from . import cache
+from . import emit
 from . import frqi
 from . import qcrank
-from ._util import rescale_data_to_angles, rescale_angles_to_fdata
+from . import sim
+from . import streaming
+from . import tiling
+from ._util import (
+    rescale_data_to_angles,
+    rescale_angles_to_fdata,
+    set_default_dtype,
+    get_default_dtype
+)
 from ._util_img import (
     convert_max_val,
     l1_distance,
@@ -15,8 +25,15 @@ from ._util_img import (
 __all__ = [
     'rescale_data_to_angles',
     'rescale_angles_to_fdata',
+    'set_default_dtype',
+    'get_default_dtype',
+    'cache',
+    'emit',
     'frqi',
     'qcrank',
+    'sim',
+    'streaming',
+    'tiling',
     'ParametricQCrankV2',
     'convert_max_val',
     'l1_distance',
@@ -0,0 +1,226 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import hashlib
+import os
+import uuid
+import qiskit
+from qiskit import qpy, transpile
+
+# total size of the cached templates after which the least recently used
+# templates are evicted
+MAX_CACHE_BYTES = 2 * 1024**3
+
+
+def get_cache_dir():
+    '''Returns the template cache directory: `$DATACIRCUITS_CACHE_DIR` if set,
+    otherwise `datacircuits/templates` in the user cache directory.'''
+    path = os.environ.get('DATACIRCUITS_CACHE_DIR')
+    if path is None:
+        path = os.path.join(
+            os.environ.get('XDG_CACHE_HOME',
+                           os.path.join(os.path.expanduser('~'), '.cache')),
+            'datacircuits', 'templates'
+        )
+    return path
+
+
+def template_key(builder, **flags):
+    '''Cache key of the circuit built by `builder` (a class) with the
+    constructor flags `flags`. The Qiskit version is part of the key since
+    QPY files are not guaranteed to be readable across versions.'''
+    text = '{}.{}:{}:qiskit-{}'.format(
+        builder.__module__, builder.__qualname__, sorted(flags.items()),
+        qiskit.__version__
+    )
+    return hashlib.sha256(text.encode()).hexdigest()[:32]
+
+
+def _template_path(key):
+    return os.path.join(get_cache_dir(), key + '.qpy')
+
+
+def load_template(key):
+    '''Loads a cached template, returns None if it is not cached (or not
+    readable).'''
+    path = _template_path(key)
+    try:
+        with open(path, 'rb') as fd:
+            circ = qpy.load(fd)[0]
+    except FileNotFoundError:
+        return None
+    except Exception:
+        # partially written or incompatible file, rebuild it
+        return None
+    os.utime(path)  # mark as recently used
+    return circ
+
+
+def save_template(key, circuit, max_bytes=None):
+    '''Stores a template in the cache and evicts the least recently used
+    templates if the cache exceeds `max_bytes` (default `MAX_CACHE_BYTES`).
+    The file is written under a temporary name and renamed, so concurrent
+    processes never read a partial template.'''
+    os.makedirs(get_cache_dir(), exist_ok=True)
+    path = _template_path(key)
+    tmp = f'{path}.{uuid.uuid4().hex}.tmp'
+    with open(tmp, 'wb') as fd:
+        qpy.dump(circuit, fd)
+    os.replace(tmp, path)
+    evict(MAX_CACHE_BYTES if max_bytes is None else max_bytes)
+
+
+def evict(max_bytes):
+    '''Removes the least recently used templates until the cache holds at most
+    `max_bytes`.'''
+    path = get_cache_dir()
+    if not os.path.isdir(path):
+        return
+    files = []
+    for name in os.listdir(path):
+        if not name.endswith('.qpy'):
+            continue
+        try:
+            st = os.stat(os.path.join(path, name))
+        except FileNotFoundError:
+            continue
+        files.append((st.st_mtime, st.st_size, name))
+    total = sum(f[1] for f in files)
+    for _, size, name in sorted(files):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(os.path.join(path, name))
+        except FileNotFoundError:
+            pass
+        total -= size
+
+
+def clear_cache():
+    '''Removes all cached templates.'''
+    evict(0)
+
+
+def parameter_vectors(circuit):
+    '''Returns the parameter vectors of a (loaded) circuit by name, so a
+    template can be bound with the same `{vector: values}` dictionaries as the
+    freshly built circuit.'''
+    vectors = {}
+    for p in circuit.parameters:
+        vector = getattr(p, 'vector', None)
+        if vector is not None:
+            vectors.setdefault(vector.name, vector)
+    return vectors
+
+
+def cached_template(builder, build, enabled=True, **flags):
+    '''Returns the template circuit of `builder` (a class) for the
+    constructor flags `flags`. It is loaded from the cache if present,
+    otherwise it is built with `build()` and stored.
+
+    Args:
+        builder:
+            class that builds the circuit, part of the cache key
+        build:
+            callable without arguments that builds the circuit
+        enabled: bool (True)
+            if False, the cache is bypassed and `build()` is returned
+        flags:
+            all constructor flags that change the circuit
+    '''
+    if not enabled:
+        return build()
+    key = template_key(builder, **flags)
+    circ = load_template(key)
+    if circ is None:
+        circ = build()
+        try:
+            save_template(key, circ)
+        except OSError:
+            pass  # a read-only cache does not prevent building circuits
+    return circ
+
+
+def circuit_fingerprint(circuit):
+    '''Content hash of a circuit: its gates, their qubits, clbits and
+    (parameter) arguments. Unlike a QPY dump it does not depend on the
+    identity of the parameter objects, so equal builds hash equal.'''
+    h = hashlib.sha256()
+    h.update(f'{circuit.num_qubits}:{circuit.num_clbits}:'
+             f'{circuit.global_phase}'.encode())
+    for inst in circuit.data:
+        h.update(repr((
+            inst.operation.name,
+            [circuit.find_bit(q).index for q in inst.qubits],
+            [circuit.find_bit(c).index for c in inst.clbits],
+            [str(p) for p in inst.operation.params]
+        )).encode())
+    return h.hexdigest()
+
+
+def backend_fingerprint(backend):
+    '''Hash of the backend name and its target: the supported operations,
+    their qubits and the reported durations and errors. A recalibrated
+    backend therefore gets a new fingerprint.'''
+    h = hashlib.sha256(str(getattr(backend, 'name', backend)).encode())
+    target = getattr(backend, 'target', None)
+    if target is not None:
+        h.update(f'{target.num_qubits}:{target.dt}'.encode())
+        for name in sorted(target.operation_names):
+            props = target[name]
+            for qargs in sorted(props, key=repr):
+                p = props[qargs]
+                h.update(repr((
+                    name, qargs,
+                    None if p is None else (p.duration, p.error)
+                )).encode())
+    return h.hexdigest()
+
+
+def transpile_key(circuit, backend=None, **kwargs):
+    '''Cache key of the transpiled `circuit` for `backend` and the
+    `qiskit.transpile` options `kwargs` (e.g. `optimization_level`,
+    `seed_transpiler`).'''
+    text = 'transpile:{}:{}:{}:qiskit-{}'.format(
+        circuit_fingerprint(circuit),
+        None if backend is None else backend_fingerprint(backend),
+        sorted(kwargs.items()), qiskit.__version__
+    )
+    return hashlib.sha256(text.encode()).hexdigest()[:32]
+
+
+def transpile_cached(circuit, backend=None, *, enabled=True, **kwargs):
+    '''Drop-in replacement for `qiskit.transpile` of a single circuit that
+    stores the result in the cache. Repeated calls with the same circuit
+    content, backend target and options load the transpiled QPY instead of
+    running the transpiler. The parameters of the returned circuit are the
+    parameter objects of `circuit`, so it binds like a fresh transpilation.
+
+    Args:
+        circuit:
+            the (parametrized) circuit
+        backend: (None)
+            target backend, part of the key through `backend_fingerprint`
+        enabled: bool (True)
+            if False, the cache is bypassed
+        kwargs:
+            options of `qiskit.transpile`, part of the key. Fix
+            `seed_transpiler` to get reproducible hits.
+    '''
+    if not enabled:
+        return transpile(circuit, backend, **kwargs)
+    key = transpile_key(circuit, backend, **kwargs)
+    circ = load_template(key)
+    if circ is None:
+        circ = transpile(circuit, backend, **kwargs)
+        try:
+            save_template(key, circ)
+        except OSError:
+            pass
+        return circ
+    # re-attach the parameters of the input circuit
+    params = {p.name: p for p in circuit.parameters}
+    circ.assign_parameters(
+        {p: params[p.name] for p in circ.parameters if p.name in params},
+        inplace=True
+    )
+    return circ
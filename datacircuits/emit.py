@@ -0,0 +1,205 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''Streaming export of QCRANK/FRQI circuits.
+
+The gates are generated row by row from the CNOT schedule and written to the
+output as they are produced, so memory use does not grow with the circuit
+size and circuits with millions of gates can be exported without building a
+`QuantumCircuit`.
+'''
+import io
+from qiskit import QuantumCircuit, qpy
+from qiskit.circuit import ParameterVector
+
+
+def iter_gates(nq_addr, nq_data, angles=None, shifts=None, use_cz=False,
+               keep_last_cx=True, barrier=True, address_h=True):
+    '''Generates the gates of a QCRANK circuit (FRQI for nq_data=1) in
+    circuit order, without measurements.
+
+    Args:
+        nq_addr: int
+            number of address qubits
+        nq_data: int
+            number of data qubits
+        angles: (None)
+            rotation angles of size (2**nq_addr, nq_data) (`angles_qcrank` of
+            a single image), None for the parametric circuit
+        shifts: sequence of int (None)
+            CNOT shift per data qubit (see `CnotSchedule`), the parallel QCRANK
+            shifts `d % nq_addr` by default
+        use_cz: bool (False)
+            CZ entangling gates with Hadamards on the data qubits, as in
+            `ParametricQCrankV2`
+        keep_last_cx: bool (True)
+            include the final CX gates
+        barrier: bool (True)
+            barrier after the address Hadamards
+        address_h: bool (True)
+            Hadamards on the address qubits
+    Yields:
+        (name, qubits, param):
+            gate name ('h', 'barrier', 'ry', 'cx', 'cz'), tuple of qubit
+            indices and the Ry angle: a float, or `(d, j)` for parameter
+            `p{d}[j]` of the parametric circuit; None for other gates
+    '''
+    n = nq_addr + nq_data
+    if shifts is None:
+        shifts = [d % nq_addr for d in range(nq_data)]
+    entangler = 'cz' if use_cz else 'cx'
+    if address_h:
+        for i in range(nq_addr):
+            yield 'h', (i,), None
+        if barrier:
+            yield 'barrier', tuple(range(n)), None
+    if use_cz:
+        for d in range(nq_data):
+            yield 'h', (nq_addr + d,), None
+    n_addr = 2**nq_addr
+    for j in range(n_addr):
+        for d in range(nq_data):
+            param = (d, j) if angles is None else float(angles[j, d])
+            yield 'ry', (nq_addr + d,), param
+        if j == n_addr - 1 and not keep_last_cx:
+            break
+        # trailing zeros of j+1, capped for the wrap-around to 0, see
+        # `_control_table`
+        tz = min(((j + 1) & -(j + 1)).bit_length() - 1, nq_addr - 1)
+        for d in range(nq_data):
+            ctrl = (nq_addr - 1 - tz + shifts[d]) % nq_addr
+            yield entangler, (ctrl, nq_addr + d), None
+    if use_cz:
+        for d in range(nq_data):
+            yield 'h', (nq_addr + d,), None
+
+
+def _qasm_param(param):
+    if isinstance(param, tuple):
+        return f'_p{param[0]}_{param[1]}_'
+    return repr(param)
+
+
+def write_qasm3(fd, nq_addr, nq_data, angles=None, measure='all',
+                reverse_bits=False, barrier=True, **kwargs):
+    '''Writes a QCRANK circuit as OpenQASM 3 text while its gates are
+    generated. The output matches `qiskit.qasm3.dumps` of the corresponding
+    `ParametrizedQCRANK`/`ParametricQCrankV2` circuit.
+
+    Args:
+        fd:
+            path or writable text file object
+        nq_addr, nq_data, angles:
+            see `iter_gates`, parameters are declared as `input float[64]`
+        measure: str ('all')
+            * 'all': `measure_all` of `ParametrizedQCRANK`
+            * 'reversed': qubit i to clbit n-1-i, as in `ParametricQCrankV2`
+            * None: no measurements
+        reverse_bits: bool (False)
+            reversed qubit order, as `ParametrizedQCRANK(reverse_bits=True)`
+        barrier: bool (True)
+            barriers after the address Hadamards and, for 'reversed', before
+            the measurements
+        kwargs:
+            further options of `iter_gates`
+    '''
+    if isinstance(fd, str):
+        with open(fd, 'w') as f:
+            return write_qasm3(f, nq_addr, nq_data, angles, measure,
+                               reverse_bits, barrier, **kwargs)
+    n = nq_addr + nq_data
+    fd.write('OPENQASM 3.0;\ninclude "stdgates.inc";\n')
+    if angles is None:
+        # declared in Qiskit's parameter order, p10 sorts before p2
+        for d in sorted(range(nq_data), key=lambda d: f'p{d}'):
+            for j in range(2**nq_addr):
+                fd.write(f'input float[64] _p{d}_{j}_;\n')
+    if measure == 'all':
+        fd.write(f'bit[{n}] meas;\n')
+    elif measure == 'reversed':
+        fd.write(f'bit[{n}] c;\n')
+    elif measure is not None:
+        raise ValueError(f'Unknown measurement {measure}')
+    fd.write(f'qubit[{n}] q;\n')
+
+    def q(i):
+        return f'q[{n - 1 - i if reverse_bits else i}]'
+
+    for name, qubits, param in iter_gates(nq_addr, nq_data, angles,
+                                          barrier=barrier, **kwargs):
+        if name == 'barrier':
+            fd.write(f'barrier {", ".join(q(i) for i in range(n))};\n')
+        elif name == 'ry':
+            fd.write(f'ry({_qasm_param(param)}) {q(qubits[0])};\n')
+        else:
+            fd.write(f'{name} {", ".join(q(i) for i in qubits)};\n')
+    if measure == 'all':
+        fd.write(f'barrier {", ".join(f"q[{i}]" for i in range(n))};\n')
+        for i in range(n):
+            fd.write(f'meas[{i}] = measure q[{i}];\n')
+    elif measure == 'reversed':
+        if barrier:
+            fd.write(f'barrier {", ".join(f"q[{i}]" for i in range(n))};\n')
+        for i in range(n):
+            fd.write(f'c[{n - 1 - i}] = measure q[{i}];\n')
+
+
+def qasm3_str(nq_addr, nq_data, angles=None, **kwargs):
+    '''Returns the OpenQASM 3 text of `write_qasm3` as a string.'''
+    out = io.StringIO()
+    write_qasm3(out, nq_addr, nq_data, angles, **kwargs)
+    return out.getvalue()
+
+
+class _Segments:
+    '''Sequence of consecutive circuit segments, each built only when it is
+    iterated over, so `qpy.dump` never holds more than one segment.'''
+    def __init__(self, nq_addr, nq_data, angles, gates_per_segment, kwargs):
+        self._args = (nq_addr, nq_data, angles)
+        self._size = gates_per_segment
+        self._kwargs = kwargs
+        n_gates = sum(1 for _ in iter_gates(*self._args, **kwargs))
+        self._len = max(1, -(-n_gates // gates_per_segment))
+
+    def __len__(self):
+        return self._len
+
+    def __iter__(self):
+        nq_addr, nq_data, angles = self._args
+        n = nq_addr + nq_data
+        p = None
+        if angles is None:
+            p = [ParameterVector(f'p{d}', 2**nq_addr) for d in range(nq_data)]
+        circ = QuantumCircuit(n)
+        for name, qubits, param in iter_gates(*self._args, **self._kwargs):
+            if name == 'ry':
+                circ.ry(param if p is None else p[param[0]][param[1]],
+                        qubits[0])
+            else:
+                getattr(circ, name)(*qubits)
+            if len(circ.data) == self._size:
+                yield circ
+                circ = QuantumCircuit(n)
+        if len(circ.data) or self._len == 1:
+            yield circ
+
+
+def write_qpy(fd, nq_addr, nq_data, angles=None, gates_per_segment=65536,
+              **kwargs):
+    '''Writes a QCRANK circuit as QPY in segments of at most
+    `gates_per_segment` gates. `qpy.load` returns the segments in circuit
+    order; composing them gives the full circuit (without measurements).
+
+    Args:
+        fd:
+            path or writable binary file object
+        nq_addr, nq_data, angles, kwargs:
+            see `iter_gates`
+        gates_per_segment: int (65536)
+            bounds the memory use of the export
+    '''
+    if isinstance(fd, str):
+        with open(fd, 'wb') as f:
+            return write_qpy(f, nq_addr, nq_data, angles, gates_per_segment,
+                             **kwargs)
+    qpy.dump(_Segments(nq_addr, nq_data, angles, gates_per_segment, kwargs),
+             fd)
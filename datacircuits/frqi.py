@@ -3,40 +3,82 @@
 from abc import ABC, abstractmethod
 import copy
 import numpy as np
+import scipy.sparse
 from qiskit import QuantumCircuit
 from qiskit.circuit import ParameterVector
+from .cache import cached_template, parameter_vectors
 from ._util import (
-    compute_control,
+    CnotSchedule,
     sfwht,
     gray_permutation,
-    convert_shots_to_pdf,
+    counts_to_histogram,
+    packed_counts_to_histogram,
     rescale_data_to_angles,
     rescale_angles_to_fdata,
-    cnot_permutation
+    cnot_permutation,
+    parameter_table,
+    resolve_dtype,
+    prune_rotation_angles,
+    compressed_schedule,
+    batched
 )
 
 
 class ParametrizedFRQI:
     '''An object to handle the parametrized FRQI circuits.'''
-    def __init__(self, nq_addr):
+    def __init__(self, nq_addr, dtype=None, cache=False):
         '''Initializes a parametrized FRQI circuit with nq_addr qubits.
 
         Args:
             nq_addr:
                 number of address qubits, total circuit is nq_addr + 1
+            dtype: (None)
+                float32 or float64 precision of the angles of the bound FRQI
+                objects and their decoders, package default if None (see
+                `set_default_dtype`)
+            cache: bool (False)
+                load the parametric circuit from the on-disk template cache
+                (see `datacircuits.cache`), building and storing it on a miss
         '''
         self.nq_addr = nq_addr
+        self.dtype = resolve_dtype(dtype)
 
-        self._p = ParameterVector('p', 2**nq_addr)
-        self._circ = QuantumCircuit(nq_addr + 1)
+        self.cnot_schedule = CnotSchedule(nq_addr)
+        self._circ = cached_template(
+            type(self), self._build_circuit, enabled=cache, nq_addr=nq_addr
+        )
+        # re-attached from the circuit if it was cached
+        self._p = parameter_vectors(self._circ)['p']
+
+    def _build_circuit(self, angles=None, keep=None, keep_last_cx=True):
+        '''Builds the parametric circuit gate by gate, or the compressed
+        circuit of the rotation `angles` with the rotations selected by the
+        bool array `keep` (see `compressed_schedule`).'''
+        nq_addr = self.nq_addr
+        circ = QuantumCircuit(nq_addr + 1)
         # add diffusion
         for i in range(nq_addr):
-            self._circ.h(i)
-        self._circ.barrier()
+            circ.h(i)
+        circ.barrier()
         # add uniform rotation
-        for i, p_i in enumerate(self._p):
-            self._circ.ry(p_i, nq_addr)
-            self._circ.cx(compute_control(i, nq_addr), nq_addr)
+        if keep is not None:
+            angles = np.asarray(angles).tolist()
+            schedule = compressed_schedule(
+                self.cnot_schedule.controls, np.reshape(keep, (-1, 1)),
+                keep_last_cx
+            )
+            for i, (rys, cxs) in enumerate(schedule):
+                if rys:
+                    circ.ry(angles[i], nq_addr)
+                for c, _ in cxs:
+                    circ.cx(c, nq_addr)
+            return circ
+        p = ParameterVector('p', 2**nq_addr)
+        controls = self.cnot_schedule.controls[:, 0].tolist()
+        for i, p_i in enumerate(p):
+            circ.ry(p_i, nq_addr)
+            circ.cx(controls[i], nq_addr)
+        return circ
 
     def __call__(self, data, max_val):
         '''Binds the parametrized FRQI to data and returns a FRQI circuit.
@@ -94,18 +136,23 @@ class FRQI:
         if isinstance(data, np.ndarray) and data.ndim == 1:
             data = data[:, np.newaxis]
         self._data = data
-        self._angles = rescale_data_to_angles(data, max_val)
+        self._angles = rescale_data_to_angles(
+            data, max_val, dtype=parametrized_frqi.dtype
+        )
         self._angles_frqi = gray_permutation(sfwht(self._angles))
         self._max_val = max_val
         self.keep_last_cx = None
         self.measure = None
         self.statevec = None
         self.reverse_bits = None
+        # configured parametric circuit, built once per configuration
+        self._circ = None
 
     def configure_output(self, keep_last_cx: bool, measure: bool,
                          statevec: bool, reverse_bits: bool):
         '''Configures the output format for the circuits. There are three
-        user settings. These method returns a copy of the underlying object.
+        user settings. These method returns a view of the underlying object:
+        the data, the angles and the parametrized FRQI are shared, not copied.
 
         Args:
             keep_last_cx: bool
@@ -124,7 +171,8 @@ class FRQI:
         !!! note
             without configuring the output circuits don't have measurements
         '''
-        new = copy.deepcopy(self)
+        new = copy.copy(self)
+        new._circ = None
         new.keep_last_cx = keep_last_cx
         new.measure = measure
         if statevec and new.measure:
@@ -135,15 +183,70 @@ class FRQI:
         new.reverse_bits = reverse_bits
         return new
 
+    def parametric_circuit(self):
+        '''Returns the parametrized FRQI circuit with the configured output
+        options applied. It is built on the first call and shared by the
+        circuits of this configuration; do not modify it in place.'''
+        if self._circ is None:
+            circ = self._pfrqi.circuit.copy()
+            if self.keep_last_cx is False:
+                circ.data.pop()
+            if self.reverse_bits:
+                circ = circ.reverse_bits()
+            if self.measure:
+                circ.measure_all()
+            if self.statevec:
+                circ.save_statevector()
+            self._circ = circ
+        return self._circ
+
+    def iter_circuits(self, batch_size=None):
+        '''Generates the bound circuits one by one from the configured
+        parametric circuit, so memory use does not grow with the number of
+        images.
+
+        Args:
+            batch_size: int (None)
+                yield lists of `batch_size` circuits instead of single circuits
+        '''
+        circ = self.parametric_circuit()
+        return batched(
+            (circ.assign_parameters(
+                {self._pfrqi.parameters: self.angles_frqi[:, i]}
+            ) for i in range(self.angles.shape[1])),
+            batch_size
+        )
+
     def generate_circuits(self):
+        return list(self.iter_circuits())
+
+    def build_compressed(self, tol=None, top_k=None):
+        '''Builds approximate circuits with the configured output options,
+        without the rotations with `|angle| <= tol` or beyond the `top_k`
+        largest, and with the CNOTs between the remaining rotations merged
+        (see `compressed_schedule`).
+
+        Args:
+            tol: float (None)
+                angle tolerance of the dropped rotations
+            top_k: int (None)
+                number of rotations kept per image
+        Returns:
+            circs:
+                list of k circuits with numeric Ry angles
+            report: dict
+                * 'depth', 'num_ry', 'num_cx': (k,) arrays of the circuit
+                  depth and gate counts
+                * 'angle_err': (k,) bound of the error of every encoded angle
+                * 'data_err': (k,) the same bound in data units
+        '''
+        keep, angle_err = prune_rotation_angles(self.angles_frqi, tol, top_k)
         circs = []
         for i in range(self.angles.shape[1]):
-            circ = self._pfrqi.circuit.assign_parameters(
-                    {self._pfrqi.parameters:
-                     self.angles_frqi[:, i]}
-                )
-            if self.keep_last_cx is False:
-                circ.data.pop()
+            circ = self._pfrqi._build_circuit(
+                self.angles_frqi[:, i], keep[:, i],
+                keep_last_cx=self.keep_last_cx is not False
+            )
             if self.reverse_bits:
                 circ = circ.reverse_bits()
             if self.measure:
@@ -151,12 +254,35 @@ class FRQI:
             if self.statevec:
                 circ.save_statevector()
             circs.append(circ)
-        return circs
+        ops = [c.count_ops() for c in circs]
+        report = {
+            'depth': np.array([c.depth() for c in circs]),
+            'num_ry': np.array([o.get('ry', 0) for o in ops]),
+            'num_cx': np.array([o.get('cx', 0) for o in ops]),
+            'angle_err': angle_err,
+            'data_err': rescale_angles_to_fdata(angle_err, self.max_val)
+        }
+        return circs, report
+
+    def parameter_table(self):
+        '''Returns the configured parametrized circuit and the parameter
+        table, an array of size (k, num_parameters) ordered like
+        `circuit.parameters`. Unlike `generate_circuits`, no circuit copies
+        are made; the pair is a SamplerV2 PUB `(circuit, table)`.'''
+        circ = self.parametric_circuit()
+        return circ, parameter_table(
+            circ.parameters, [self._pfrqi.parameters],
+            self.angles_frqi[:, np.newaxis]
+        )
 
     @property
     def nq_addr(self):
         return self._pfrqi.nq_addr
 
+    @property
+    def dtype(self):
+        return self._pfrqi.dtype
+
     @property
     def data(self):
         return self._data
@@ -194,10 +320,28 @@ class _DecoderFRQI(ABC):
 
 class QKAtan2DecoderFRQI(_DecoderFRQI):
     '''Qiskit compatible atan2 decoder for FRQI.'''
-    def angles_from_yields(self, yields):
-        '''The yields are  expected as a list of dictionaries in the standard
-        qiskit format.'''
-        pdfs = self.yields_to_pdf(yields, self._frqi.nq_addr + 1)
+    def angles_from_yields(self, yields, is_numpy=False):
+        '''Decodes the angles of all k circuits at once. The yields are
+        expected as either option below:
+            * list of dictionaries in the standard qiskit format
+            * sparse histogram from `counts_to_histogram`
+            * numpy histogram of size (2**(nq_addr+1), k) (`is_numpy=True`)
+            * packed counts `(raw_ikey, raw_mshot[, raw_nkey])` with arrays of
+              size (k, max_keys), see `packed_counts_to_histogram`
+        '''
+        if isinstance(yields, tuple):
+            pdfs = packed_counts_to_histogram(
+                yields[0], yields[1], self._frqi.nq_addr + 1,
+                dtype=self._frqi.dtype
+            )
+        elif scipy.sparse.issparse(yields):
+            pdfs = yields.toarray().astype(self._frqi.dtype, copy=False)
+        elif is_numpy:
+            assert yields.ndim == 2  # expected shape:  [bitstrings,images]
+            pdfs = yields.astype(self._frqi.dtype, copy=False)
+        else:
+            pdfs = self.yields_to_pdf(yields, self._frqi.nq_addr + 1,
+                                      dtype=self._frqi.dtype)
         pdfs = np.sqrt(pdfs)
         if self._frqi.keep_last_cx is False:
             pdfs = cnot_permutation(pdfs, 0, self._frqi.nq_addr)
@@ -213,7 +357,7 @@ class QKAtan2DecoderFRQI(_DecoderFRQI):
         '''
         if isinstance(statevec, list):
             statevec = np.stack(statevec, axis=1)
-        statevec = np.abs(statevec)
+        statevec = np.abs(statevec).astype(self._frqi.dtype, copy=False)
         if self._frqi.keep_last_cx is False:
             statevec = cnot_permutation(statevec, 0, self._frqi.nq_addr)
         return 2 * np.arctan2(
@@ -221,13 +365,9 @@ class QKAtan2DecoderFRQI(_DecoderFRQI):
         )
 
     @staticmethod
-    def yields_to_pdf(yields, nqubits, normalize=False):
+    def yields_to_pdf(yields, nqubits, normalize=False, dtype=None):
         '''The yields are  expected as a list of dictionaries in the standard
         qiskit format. The number of qubits is the length of each bitstring.
         The normalize flag indicates if sum to 1 or not.'''
-        if isinstance(yields, dict):
-            yields = [yields]
-        pdfs = np.empty([2**nqubits, len(yields)])
-        for i, y in enumerate(yields):
-            pdfs[:, i] = convert_shots_to_pdf(y, normalize=normalize)
-        return pdfs
+        return counts_to_histogram(yields, nqubits, normalize=normalize,
+                                   dtype=dtype)
@@ -3,20 +3,24 @@
 from abc import ABC, abstractmethod
 from typing import Type
 import numpy as np
+import scipy.sparse
 from qiskit import QuantumCircuit, transpile
 from qiskit.circuit import ParameterVector
+from .cache import cached_template, parameter_vectors, transpile_cached
 from ._util import (
     get_bit,
     yields_to_pdf,
-    get_bits,
-    compute_control,
-    shifted_gray_permutation,
-    sfwht,
-    marginal_distribution,
-    con_to_ang,
+    gather_bits,
+    gather_bits_table,
+    CnotSchedule,
+    rotation_angles,
+    address_data_marginals,
+    unpack_bitplanes,
     rescale_angles_to_bit_to_data,
     rescale_bits_to_angle,
-    cnot_permutation
+    cnot_permutation,
+    parameter_table,
+    batched
 )
 
 
@@ -27,7 +31,7 @@ class _DecoderNEQR(ABC):
         self.nq_data = nq_data
 
     def yields_to_data(self, yields, is_numpy=False):
-        if is_numpy:
+        if is_numpy or scipy.sparse.issparse(yields):
             assert yields.ndim == 2  # expected shape:  [bitstrings,images]
             pdfs = yields
         else:  # yields is a Qiskit dictionary
@@ -42,24 +46,51 @@ class NoiseFreeDecoderNEQR(_DecoderNEQR):
     def yields_to_data(self, yields, is_numpy=False):
         pdfs = super().yields_to_data(yields, is_numpy)
         k = pdfs.shape[1]
+        n = self.nq_addr + self.nq_data
+        addr_bits = range(0, self.nq_addr)
+        data_bits = range(self.nq_addr, n)
+        if scipy.sparse.issparse(pdfs):
+            pdfs = scipy.sparse.csc_array(pdfs)
+            pdfs.sort_indices()
+        else:
+            loc_map = gather_bits_table(n, addr_bits)
+            val_map = gather_bits_table(n, data_bits)
         data = np.zeros([2**self.nq_addr, k])
         for kk in range(k):
-            for i in range(pdfs.shape[0]):
-                if pdfs[i, kk] > 0:
-                    loc = get_bits(i, list(range(0, self.nq_addr)))
-                    if data[loc, kk] == 0:
-                        data[loc, kk] = get_bits(
-                            i,
-                            list(
-                                range(
-                                    self.nq_addr,
-                                    self.nq_data + self.nq_addr
-                                )
-                            )
-                        )
+            if scipy.sparse.issparse(pdfs):
+                col = slice(pdfs.indptr[kk], pdfs.indptr[kk + 1])
+                observed = pdfs.indices[col][pdfs.data[col] > 0]
+                loc = gather_bits(observed, addr_bits)
+                val = gather_bits(observed, data_bits)
+            else:
+                observed = np.flatnonzero(pdfs[:, kk] > 0)
+                loc = loc_map[observed]
+                val = val_map[observed]
+            # the first non-zero value observed at an address is kept
+            nz = val != 0
+            loc, first = np.unique(loc[nz], return_index=True)
+            data[loc, kk] = val[nz][first]
         return data
 
 
+def _gray_traversal(values, nq_addr):
+    '''Visits the addresses with non-zero values in Gray code order.
+    Yields `(address, toggle)`: the address bits to flip so that the zero
+    bits of the address are inverted, and finally `(None, toggle)` to undo
+    the remaining flips. Consecutive Gray code addresses differ in one bit,
+    so most toggles flip a single address qubit.'''
+    mask = 2**nq_addr - 1
+    flipped = 0
+    for g in range(2**nq_addr):
+        i = g ^ (g >> 1)
+        if values[i] == 0:
+            continue
+        target = ~i & mask
+        yield i, flipped ^ target
+        flipped = target
+    yield None, flipped
+
+
 class NEQR_MCX:
     '''An object to handle circuits for NEQR encodings through multi-controlled
     CX gates.'''
@@ -68,7 +99,8 @@ class NEQR_MCX:
                  measure: bool = True,
                  statevec: bool = False,
                  reverse_bits: bool = False,
-                 barrier: bool = True):
+                 barrier: bool = True,
+                 gray_order: bool = False):
         '''
         Initializes a NEQR circuit with nq_addr qubits and nq_data qubits. The
         data is encoded through multi-controlled CNOT gates.
@@ -86,6 +118,11 @@ class NEQR_MCX:
                 set to true for reversing the order of the bits
             barrier: bool (False)
                 add barrier to circuit
+            gray_order: bool (False)
+                visit the addresses in Gray code order and skip zero pixels,
+                so only the address bits that change between two encoded
+                pixels are flipped (see `gate_counts`). The circuits prepare
+                the same state.
 
         !!! note
             `measure` and `statevec` cannot be simultaneously set to True. If
@@ -105,6 +142,7 @@ class NEQR_MCX:
         else:
             self.statevec = statevec
         self.reverse_bits = reverse_bits
+        self.gray_order = gray_order
 
     @property
     def nq_addr(self):
@@ -114,22 +152,14 @@ class NEQR_MCX:
     def nq_data(self):
         return self._nq_data
 
-    def generate_from_data(self, data):
-        '''Generates the NEQR circuit that encodes the data.
-
-        Args:
-            data:
-                Integer numerical data with bit-depth nq_data to generate NEQR
-                circuits for. The following input options are supported:
-                    * numpy array of size (2**nq_addr,)
-                    * list of numpy arrays of size (2**nq_addr,)
-                    * numpy array of size (2**nq_addr, k)
-        '''
+    def _check_data(self, data):
+        '''Validates the data and returns it as array of size (2**nq_addr,
+        k).'''
         if not isinstance(data, (np.ndarray, list)):
             raise RuntimeError('data should be either numpy array or list of '
                                f'numpy array, got {isinstance(data)}')
         if isinstance(data, list):
-            data = np.stack(data, axis=2)
+            data = np.stack(data, axis=1)
         if isinstance(data, np.ndarray) and data.ndim == 1:
             data = data[..., np.newaxis]
         if data.shape[0] != 2**self.nq_addr:
@@ -143,38 +173,121 @@ class NEQR_MCX:
                 f'Input data not properly normalized, expected data in range '
                 f'[0, {2**self.nq_data-1}], found {np.max(data)}.'
             )
-        circs = []
-        for k in range(data.shape[1]):
-            circ = QuantumCircuit(self._nq_addr + self._nq_data)
-            # add diffusion
-            for i in range(self.nq_addr):
-                circ.h(i)
-            if self.barrier:
-                circ.barrier()
-            # add multi-controlled CX gates
-            for i, bi in enumerate(data[:, k]):
-                # flip zero control bits
+        return data
+
+    def _build_circuit(self, values):
+        '''Builds the circuit of one image. With `reverse_bits` the gates
+        are placed on the reversed qubits directly instead of reversing the
+        finished circuit.'''
+        n = self._nq_addr + self._nq_data
+        if self.reverse_bits:
+            q = list(range(n - 1, -1, -1))
+        else:
+            q = list(range(n))
+        circ = QuantumCircuit(n)
+        # add diffusion
+        for i in range(self.nq_addr):
+            circ.h(q[i])
+        if self.barrier:
+            circ.barrier()
+        ctrl = q[:self.nq_addr]
+        if self.gray_order:
+            values = values.tolist()
+            for i, toggle in _gray_traversal(values, self.nq_addr):
                 for j in range(self.nq_addr):
-                    if not get_bit(i, j):
-                        circ.x(j)
-                ctrl = list(range(0, self.nq_addr))
+                    if get_bit(toggle, j):
+                        circ.x(q[j])
+                if i is None:
+                    break
                 for j in range(self.nq_data):
-                    if get_bit(bi, j):
-                        circ.mcx(ctrl, self.nq_addr + j)
-                # flip zero control bits back
-                for j in range(self.nq_addr):
-                    if not get_bit(i, j):
-                        circ.x(j)
+                    if get_bit(values[i], j):
+                        circ.mcx(ctrl, q[self.nq_addr + j])
                 if self.barrier:
                     circ.barrier()
-            if self.reverse_bits:
-                circ = circ.reverse_bits()
             if self.measure:
                 circ.measure_all()
             if self.statevec:
                 circ.save_statevector()
-            circs.append(circ)
-        return circs
+            return circ
+        # add multi-controlled CX gates
+        for i, bi in enumerate(values.tolist()):
+            # flip zero control bits
+            for j in range(self.nq_addr):
+                if not get_bit(i, j):
+                    circ.x(q[j])
+            for j in range(self.nq_data):
+                if get_bit(bi, j):
+                    circ.mcx(ctrl, q[self.nq_addr + j])
+            # flip zero control bits back
+            for j in range(self.nq_addr):
+                if not get_bit(i, j):
+                    circ.x(q[j])
+            if self.barrier:
+                circ.barrier()
+        if self.measure:
+            circ.measure_all()
+        if self.statevec:
+            circ.save_statevector()
+        return circ
+
+    def gate_counts(self, data, gray_order=None):
+        '''Counts the X and MCX gates of the circuits without building them.
+
+        Args:
+            data:
+                see `generate_from_data`
+            gray_order: bool (None)
+                traversal to count, the configured one if None
+        Returns:
+            dict of (k,) arrays 'x' and 'mcx'. The MCX count is the number of
+            set data bits for both traversals; the address order traversal
+            always needs `nq_addr * 2**nq_addr` X gates, the Gray code
+            traversal at most `2**nq_addr + 2 * nq_addr - 1` and fewer for
+            data with zero pixels.
+        '''
+        data = self._check_data(data)
+        if gray_order is None:
+            gray_order = self.gray_order
+        mcx = sum(((data >> j) & 1).sum(axis=0) for j in range(self.nq_data))
+        if not gray_order:
+            x = np.full(data.shape[1], self.nq_addr * 2**self.nq_addr)
+        else:
+            x = np.array([
+                sum(bin(toggle).count('1') for _, toggle in
+                    _gray_traversal(data[:, k].tolist(), self.nq_addr))
+                for k in range(data.shape[1])
+            ])
+        return {'x': x, 'mcx': np.asarray(mcx)}
+
+    def iter_from_data(self, data, batch_size=None):
+        '''Generates the NEQR circuits that encode the data one by one, so
+        the circuits of a large data set never need to be held in memory at
+        once. The data is validated before the first circuit is built.
+
+        Args:
+            data:
+                see `generate_from_data`
+            batch_size: int (None)
+                yield lists of `batch_size` circuits instead of single circuits
+        '''
+        data = self._check_data(data)
+        return batched(
+            (self._build_circuit(data[:, k]) for k in range(data.shape[1])),
+            batch_size
+        )
+
+    def generate_from_data(self, data):
+        '''Generates the NEQR circuit that encodes the data.
+
+        Args:
+            data:
+                Integer numerical data with bit-depth nq_data to generate NEQR
+                circuits for. The following input options are supported:
+                    * numpy array of size (2**nq_addr,)
+                    * list of numpy arrays of size (2**nq_addr,)
+                    * numpy array of size (2**nq_addr, k)
+        '''
+        return list(self.iter_from_data(data))
 
 
 class _DecoderNEQCRANK(ABC):
@@ -197,19 +310,15 @@ class _DecoderNEQCRANK(ABC):
         return rescale_angles_to_bit_to_data(angles)
 
     def dist_to_marginals(self, dist):
-        out = np.empty((2**(self.nq_addr+1), self.nq_data))
-        for i in range(self.nq_data):
-            t_out = [k + self.nq_addr for k in range(self.nq_data) if k != i]
-            md = marginal_distribution(dist, t_out)
-            out[:, i] = np.ravel(md)
-        return out
+        '''Address/data marginals of size (2**(nq_addr+1), nq_data, k).'''
+        return address_data_marginals(dist, self.nq_addr, self.nq_data)
 
 
 class QKAtan2DecoderQCRANK(_DecoderNEQCRANK):
     '''Qiskit compatible atan2 decoder for NEQR-QCRANK.'''
     def angles_from_yields(self, yields, is_numpy=False):
         '''Decodes the angles from the yields of a NEQR-QCRANK experiment.'''
-        if is_numpy:
+        if is_numpy or scipy.sparse.issparse(yields):
             assert yields.ndim == 2  # expected shape:  [bitstrings,images]
             pdfs = yields
         else:  # yields is a Qiskit dictionary
@@ -217,12 +326,12 @@ class QKAtan2DecoderQCRANK(_DecoderNEQCRANK):
         marginal_pdfs = self.dist_to_marginals(pdfs)
         marginal_pdfs = np.sqrt(marginal_pdfs)
         if self.keep_last_cx is False:
-            for i in range(self.nq_data):
-                marginal_pdfs[:, i] = cnot_permutation(
-                    marginal_pdfs[:, i],
-                    i % self.nq_addr,
-                    self.nq_addr
-                )
+            cnot_permutation(
+                marginal_pdfs,
+                [i % self.nq_addr for i in range(self.nq_data)],
+                self.nq_addr,
+                inplace=True
+            )
         return np.arctan2(marginal_pdfs[1::2], marginal_pdfs[::2])
 
     def angles_from_statevec(self, statevec):
@@ -233,12 +342,12 @@ class QKAtan2DecoderQCRANK(_DecoderNEQCRANK):
         statevec = np.abs(statevec)
         statevec = self.dist_to_marginals(statevec)
         if self.keep_last_cx is False:
-            for i in range(self.nq_data):
-                statevec[:, i] = cnot_permutation(
-                    statevec[:, i],
-                    i % self.nq_addr,
-                    self.nq_addr
-                )
+            cnot_permutation(
+                statevec,
+                [i % self.nq_addr for i in range(self.nq_data)],
+                self.nq_addr,
+                inplace=True
+            )
         return np.arctan2(
             statevec[1::2], statevec[::2]
         )
@@ -251,7 +360,8 @@ class ParametrizedNEQCRANK:
                  keep_last_cx: bool = True,
                  measure: bool = True,
                  statevec: bool = False,
-                 reverse_bits: bool = False):
+                 reverse_bits: bool = False,
+                 cache: bool = False):
         '''Initializes a parametrized NEQCRANK circuit with nq_addr qubits and
         nq_data data qubits. Total number of qubits in the circuit is nq_addr +
         nq_data
@@ -269,6 +379,9 @@ class ParametrizedNEQCRANK:
                 set to true for state vector simulation
             reverse_bits: bool (False)
                 set to true for reversing the order of the bits
+            cache: bool (False)
+                load the parametric circuit from the on-disk template cache
+                (see `datacircuits.cache`), building and storing it on a miss
 
         !!! note
             `measure` and `statevec` cannot be simultaneously set to True. If
@@ -288,72 +401,103 @@ class ParametrizedNEQCRANK:
         else:
             self.statevec = statevec
         self.reverse_bits = reverse_bits
+        self.cnot_schedule = CnotSchedule(
+            nq_addr, [i % nq_addr for i in range(nq_data)]
+        )
+        self.circuit = cached_template(
+            type(self), self._build_circuit, enabled=cache, nq_addr=nq_addr,
+            nq_data=nq_data, keep_last_cx=keep_last_cx, measure=measure,
+            reverse_bits=reverse_bits
+        )
+        # parameter vectors (re-attached from the circuit if it was cached)
+        vectors = parameter_vectors(self.circuit)
+        self._p = [vectors[f'p{i}'] for i in range(nq_data)]
+        if self.statevec:
+            self.circuit.save_statevector()
+        self._data = None
+        self._max_val = None
+        self._angles = None
+        self._angles_qcrank = None
+
+    def _build_circuit(self):
+        '''Builds the parametric circuit gate by gate.'''
+        nq_addr = self.nq_addr
+        nq_data = self.nq_data
         # parameter vector
-        self._p = [
-            ParameterVector(f'p{i}', 2**nq_addr) for i in range(nq_data)
-        ]
+        p = [ParameterVector(f'p{i}', 2**nq_addr) for i in range(nq_data)]
         # generate circuit
-        self.circuit = QuantumCircuit(nq_addr + nq_data)
+        circuit = QuantumCircuit(nq_addr + nq_data)
         # add diffusion
         for i in range(nq_addr):
-            self.circuit.h(i)
-        self.circuit.barrier()
+            circuit.h(i)
+        circuit.barrier()
         # add nested and shifted uniform rotations
+        controls = self.cnot_schedule.controls.tolist()
         for j in range(2**nq_addr):
             for i in range(nq_data):
-                self.circuit.ry(self._p[i][j], nq_addr + i)
+                circuit.ry(p[i][j], nq_addr + i)
             for i in range(nq_data):
-                self.circuit.cx(
-                    compute_control(j, nq_addr, shift=i % self.nq_addr),
-                    nq_addr + i
-                )
+                circuit.cx(controls[j][i], nq_addr + i)
         if self.keep_last_cx is False:
-            self.circuit.data.pop(slice(-1, -self.nq_data-1, -1))
+            circuit.data.pop(slice(-1, -self.nq_data-1, -1))
         if self.reverse_bits:
-            self.circuit = self.circuit.reverse_bits()
+            circuit = circuit.reverse_bits()
         if self.measure:
-            self.circuit.measure_all()
-        if self.statevec:
-            self.circuit.save_statevector()
-        self._data = None
-        self._max_val = None
-        self._angles = None
-        self._angles_qcrank = None
-
-    def transpile(self, *args, **kwargs):
-        self.circuit = transpile(self.circuit, *args, **kwargs)
+            circuit.measure_all()
+        return circuit
+
+    def transpile(self, *args, cache=False, **kwargs):
+        '''Transpiles the parametrized circuit in place with
+        `qiskit.transpile`. With `cache=True` the result is stored in and
+        reused from the on-disk cache (see `datacircuits.cache`), keyed by
+        the circuit, the backend target and the transpiler options; the
+        backend is then the only positional argument.'''
+        if not cache:
+            self.circuit = transpile(self.circuit, *args, **kwargs)
+        elif len(args) > 1:
+            raise TypeError(
+                'transpile(cache=True) takes the backend as the only '
+                f'positional argument, got {len(args)}; pass the other '
+                'transpiler options by keyword'
+            )
+        else:
+            self.circuit = transpile_cached(self.circuit, *args, **kwargs)
 
-    def bind_data(self, data):
+    def bind_data(self, data, workers=None):
         '''Enables binding the QCRANK circuit to data
 
         Args:
             data:
-                Numerical data to bind to the parametrized QCRANK circuit:
-                  * numpy array of size (2**nq_addr, nq_data)
-                  * list of numpy arrays of size (2**nq_addr, nq_data)
-                  * numpy array of size (2**nq_addr, nq_data, k)
+                Integer data with bit-depth nq_data to bind to the parametrized
+                QCRANK circuit:
+                  * numpy array of size (2**nq_addr,)
+                  * list of numpy arrays of size (2**nq_addr,)
+                  * numpy array of size (2**nq_addr, k)
+                a memory-mapped array is kept as is, it is not copied
+            workers: int (None)
+                number of processes for transforming very large batches, see
+                `rotation_angles`
         '''
         if not isinstance(data, (np.ndarray, list)):
             raise RuntimeError('data should be either numpy array or list of '
                                f'numpy array, got {isinstance(data)}')
         if isinstance(data, list):
-            data = np.stack(data, axis=2)
-        if isinstance(data, np.ndarray) and data.ndim == 2:
+            data = np.stack(data, axis=1)
+        if isinstance(data, np.ndarray) and data.ndim == 1:
             data = data[..., np.newaxis]
-        if data.shape[0] != 2**self.nq_addr:
+        if data.shape[0] != 2**self.nq_addr or data.ndim != 2:
             raise RuntimeError(
                 f'Input data of incorrect shape {data.shape}, expecting '
-                f'({2**self.nq_addr}, {self.nq_data}, ...) '
-                '[(2**nq_addr, nq_data, k)]'
+                f'({2**self.nq_addr}, ...) '
+                '[(2**nq_addr, k)]'
             )
         self._data = data
-        self._color_bits = con_to_ang(data, self.nq_addr, self.nq_data)
+        # (2**nq_addr, nq_data, k) bit planes
+        self._color_bits = unpack_bitplanes(data, self.nq_data)
         self._angles = rescale_bits_to_angle(self._color_bits)
-        self._angles_qcrank = np.empty(self._angles.shape)
-        for r in range(self._angles.shape[1]):
-            self._angles_qcrank[:, r] = shifted_gray_permutation(
-                sfwht(2 * self._angles[:, r]), r % self.nq_addr
-            )
+        self._angles_qcrank = rotation_angles(
+            2 * self._angles, self.cnot_schedule.shifts, workers=workers
+        )
 
     @property
     def nq_addr(self):
@@ -367,6 +511,10 @@ class ParametrizedNEQCRANK:
     def data(self):
         return self._data
 
+    @property
+    def angles(self):
+        return self._angles
+
     @property
     def angles_qcrank(self):
         return self._angles_qcrank
@@ -377,15 +525,27 @@ class ParametrizedNEQCRANK:
             raise RuntimeError('Parametrized QCRANK circuit is not yet binded '
                                'to data. Run `bind_data` method first.`')
         circs = []
-        for j in range(1):
+        for j in range(self.angles_qcrank.shape[2]):
             my_dict = {}
             for i in range(self.nq_data):
                 my_dict[self.parameters[i]] = \
-                    self.angles_qcrank[:, i]
-            circ = self.circuit.bind_parameters(my_dict)
+                    self.angles_qcrank[:, i, j]
+            circ = self.circuit.assign_parameters(my_dict)
             circs.append(circ)
         return circs
 
+    def parameter_table(self):
+        '''Returns the parametrized circuit and the parameter table of the
+        bound data, an array of size (k, num_parameters) ordered like
+        `circuit.parameters`. Unlike `instantiate_circuits`, no circuit copies
+        are made; the pair is a SamplerV2 PUB `(circuit, table)`.'''
+        if self.angles_qcrank is None:
+            raise RuntimeError('Parametrized QCRANK circuit is not yet binded '
+                               'to data. Run `bind_data` method first.`')
+        return self.circuit, parameter_table(
+            self.circuit.parameters, self.parameters, self.angles_qcrank
+        )
+
     @property
     def parameters(self):
         '''Returns the parameter vectors.'''
@@ -3,26 +3,32 @@
 from abc import ABC, abstractmethod
 from typing import Type
 import numpy as np
+import scipy.sparse
 from qiskit import QuantumCircuit, transpile
 from qiskit.circuit import ParameterVector
+from .cache import cached_template, parameter_vectors, transpile_cached
 from ._util import (
-    compute_control,
-    shifted_gray_permutation,
-    sfwht,
-    convert_shots_to_pdf,
-    marginal_distribution,
+    CnotSchedule,
+    rotation_angles,
+    counts_to_histogram,
+    address_data_marginals,
     rescale_angles_to_fdata,
     rescale_data_to_angles,
-    cnot_permutation
+    cnot_permutation,
+    parameter_table,
+    resolve_dtype,
+    prune_rotation_angles,
+    compressed_schedule
 )
 
 
 class _DecoderQCRANK(ABC):
     '''Abstract base class for QCRANK data decoders.'''
-    def __init__(self, nq_addr, nq_data, keep_last_cx) -> None:
+    def __init__(self, nq_addr, nq_data, keep_last_cx, dtype=None) -> None:
         self.nq_addr = nq_addr
         self.nq_data = nq_data
         self.keep_last_cx = keep_last_cx
+        self.dtype = resolve_dtype(dtype)
 
     @abstractmethod
     def angles_from_yields(self, yields):
@@ -40,63 +46,87 @@ class _DecoderQCRANK(ABC):
     def angles_to_fdata(angles, max_val=256):
         return rescale_angles_to_fdata(angles, max_val=max_val)
 
-    def dist_to_marginals(self, dist):
-        out = np.empty((2**(self.nq_addr+1), self.nq_data, *dist.shape[1:]))
-        for i in range(self.nq_data):
-            t_out = [k + self.nq_addr for k in range(self.nq_data) if k != i]
-            out[:, i] = marginal_distribution(dist, t_out)
-        return out
+    def dist_to_marginals(self, dist, chunk_size=None, transform=None):
+        return address_data_marginals(
+            dist, self.nq_addr, self.nq_data, chunk_size=chunk_size,
+            transform=transform, dtype=self.dtype
+        )
 
 
 class QKAtan2DecoderQCRANK(_DecoderQCRANK):
     '''Qiskit compatible atan2 decoder for QCRANK.'''
     def angles_from_yields(self, yields, is_numpy=False):
-        '''Decodes the angles from the yields of a QCRANK experiment.'''
-        if is_numpy:
+        '''Decodes the angles from the yields of a QCRANK experiment. The
+        yields are either Qiskit counts dictionaries, a numpy histogram
+        (`is_numpy=True`) or a sparse histogram from `counts_to_histogram`.'''
+        if scipy.sparse.issparse(yields):
+            pdfs = yields.astype(self.dtype, copy=False)
+        elif is_numpy:
             assert yields.ndim == 2  # expected shape:  [bitstrings,images]
-            pdfs = yields
+            pdfs = yields.astype(self.dtype, copy=False)
         else:  # yields is a Qiskit dictionary
-            pdfs = self.yields_to_pdf(yields, self.nq_addr + self.nq_data)
+            pdfs = self.yields_to_pdf(yields, self.nq_addr + self.nq_data,
+                                      dtype=self.dtype)
         marginal_pdfs = self.dist_to_marginals(pdfs)
         marginal_pdfs = np.sqrt(marginal_pdfs)
         if self.keep_last_cx is False:
-            for i in range(self.nq_data):
-                marginal_pdfs[:, i] = cnot_permutation(
-                    marginal_pdfs[:, i],
-                    i % self.nq_addr,
-                    self.nq_addr
-                )
+            cnot_permutation(
+                marginal_pdfs,
+                [i % self.nq_addr for i in range(self.nq_data)],
+                self.nq_addr,
+                inplace=True
+            )
         return 2 * np.arctan2(marginal_pdfs[1::2], marginal_pdfs[::2])
 
-    def angles_from_statevec(self, statevec):
+    def angles_from_statevec(self, statevec, chunk_size=None):
         '''Decodes the angles from the state vector simulation of a QCRANK
-        experiment.'''
+        experiment.
+
+        Args:
+            statevec:
+                state vector(s) as a numpy array (or memmap) of size
+                (2**(nq_addr + nq_data),) or (2**(nq_addr + nq_data), k), a
+                `qiskit.quantum_info.Statevector` or a list of either
+            chunk_size: int (None)
+                number of addresses decoded at once. The amplitudes are then
+                visited in blocks and list entries one at a time, so no
+                stacked or absolute-valued copy of all state vectors is made.
+                None decodes all at once.
+        '''
         if isinstance(statevec, list):
-            statevec = np.stack(statevec, axis=1)
-        statevec = np.abs(statevec)
-        statevec = self.dist_to_marginals(statevec)
-        if self.keep_last_cx is False:
-            for i in range(self.nq_data):
-                statevec[:, i] = cnot_permutation(
-                    statevec[:, i],
-                    i % self.nq_addr,
-                    self.nq_addr
+            # Statevector.data is a view of the amplitudes
+            statevec = [getattr(sv, 'data', sv) for sv in statevec]
+            if chunk_size is None:
+                statevec = self.dist_to_marginals(
+                    np.stack(statevec, axis=1), transform=np.abs
                 )
+            else:
+                statevec = np.stack([
+                    self.dist_to_marginals(sv, chunk_size, np.abs)
+                    for sv in statevec
+                ], axis=-1)
+        else:
+            statevec = self.dist_to_marginals(
+                getattr(statevec, 'data', statevec), chunk_size, np.abs
+            )
+        if self.keep_last_cx is False:
+            cnot_permutation(
+                statevec,
+                [i % self.nq_addr for i in range(self.nq_data)],
+                self.nq_addr,
+                inplace=True
+            )
         return 2 * np.arctan2(
             statevec[1::2], statevec[::2]
         )
 
     @staticmethod
-    def yields_to_pdf(yields, nqubits, normalize=False):
+    def yields_to_pdf(yields, nqubits, normalize=False, dtype=None):
         '''The yields are  expected as a list of dictionaries in the standard
         qiskit format. The number of qubits is the length of each bitstring.
         The normalize flag indicates if sum to 1 or not.'''
-        if isinstance(yields, dict):
-            yields = [yields]
-        pdfs = np.empty([2**nqubits, len(yields)])
-        for i, y in enumerate(yields):
-            pdfs[:, i] = convert_shots_to_pdf(y, normalize=normalize)
-        return pdfs
+        return counts_to_histogram(yields, nqubits, normalize=normalize,
+                                   dtype=dtype)
 
 
 class ParametrizedQCRANK:
@@ -108,7 +138,9 @@ class ParametrizedQCRANK:
                  statevec: bool = False,
                  reverse_bits: bool = False,
                  barrier: bool = True,
-                 parallel: bool = True):
+                 parallel: bool = True,
+                 dtype=None,
+                 cache: bool = False):
         '''Initializes a parametrized QCRANK circuit with nq_addr qubits and
         nq_data data qubits. Total number of qubits in the circuit is nq_addr +
         nq_data
@@ -130,6 +162,12 @@ class ParametrizedQCRANK:
                 add a barrier to the circuit
             parallel: bool (True)
                 execute the CNOTs in parallel or sequential
+            dtype: (None)
+                float32 or float64 precision of the angles and the decoder,
+                package default if None (see `set_default_dtype`)
+            cache: bool (False)
+                load the parametric circuit from the on-disk template cache
+                (see `datacircuits.cache`), building and storing it on a miss
 
         !!! note
             `measure` and `statevec` cannot be simultaneously set to True. If
@@ -141,7 +179,9 @@ class ParametrizedQCRANK:
         self._nq_addr = nq_addr
         self._nq_data = nq_data
         self.keep_last_cx = keep_last_cx
-        self.decoder = decoder(nq_addr, nq_data, keep_last_cx)
+        self.dtype = resolve_dtype(dtype)
+        self.decoder = decoder(nq_addr, nq_data, keep_last_cx,
+                               dtype=self.dtype)
         self.parallel = parallel
         if statevec and measure:
             raise RuntimeWarning('Ignoring statevec flag over measurement'
@@ -149,45 +189,104 @@ class ParametrizedQCRANK:
         else:
             self.statevec = statevec
         self.reverse_bits = reverse_bits
-        # parameter vector
-        self._p = [
-            ParameterVector(f'p{i}', 2**nq_addr) for i in range(nq_data)
-        ]
+        self.cnot_schedule = CnotSchedule(
+            nq_addr, [i % nq_addr if parallel else 0 for i in range(nq_data)]
+        )
+        self._barrier = barrier
+        self._measure = measure
+        self._cache = cache
+        # without the cache, the parametric circuit is built on first use,
+        # `build_bound` does not need it
+        self._circuit = None
+        self._p = None
+        if cache:
+            self.circuit  # load or store the template up front
+        self._data = None
+        self._max_val = None
+        self._angles = None
+        self._angles_qcrank = None
+
+    @property
+    def circuit(self):
+        '''The parametrized circuit.'''
+        if self._circuit is None:
+            self._circuit = cached_template(
+                type(self),
+                lambda: self._build_circuit(self._barrier, self._measure),
+                enabled=self._cache, nq_addr=self.nq_addr,
+                nq_data=self.nq_data, keep_last_cx=self.keep_last_cx,
+                measure=self._measure, reverse_bits=self.reverse_bits,
+                barrier=self._barrier, parallel=self.parallel
+            )
+            if self.statevec:
+                self._circuit.save_statevector()
+        return self._circuit
+
+    @circuit.setter
+    def circuit(self, circuit):
+        self._circuit = circuit
+
+    def _build_circuit(self, barrier, measure, angles=None, keep=None):
+        '''Builds the circuit gate by gate: the parametric circuit, or with
+        `angles` of size (2**nq_addr, nq_data) (`angles_qcrank` of one image)
+        the bound circuit with numeric Ry angles. A bool array `keep` of the
+        same size selects the rotations of a compressed circuit.'''
+        nq_addr = self.nq_addr
+        nq_data = self.nq_data
+        if angles is None:
+            # parameter vector
+            p = [ParameterVector(f'p{i}', 2**nq_addr) for i in range(nq_data)]
+        else:
+            p = np.asarray(angles).T.tolist()
         # generate circuit
-        self.circuit = QuantumCircuit(nq_addr + nq_data)
+        circuit = QuantumCircuit(nq_addr + nq_data)
         # add diffusion
         for i in range(nq_addr):
-            self.circuit.h(i)
+            circuit.h(i)
         if barrier:
-            self.circuit.barrier()
+            circuit.barrier()
         # add nested and shifted uniform rotations
-        for j in range(2**nq_addr):
-            for i in range(nq_data):
-                self.circuit.ry(self._p[i][j], nq_addr + i)
-            for i in range(nq_data):
-                self.circuit.cx(
-                    compute_control(j, nq_addr,
-                                    shift=i % self.nq_addr if parallel else 0
-                                    ),
-                    nq_addr + i
-                )
-        if self.keep_last_cx is False:
-            self.circuit.data.pop(slice(-1, -self.nq_data-1, -1))
+        if keep is not None:
+            schedule = compressed_schedule(self.cnot_schedule.controls, keep,
+                                           self.keep_last_cx)
+            for j, (rys, cxs) in enumerate(schedule):
+                for i in rys:
+                    circuit.ry(p[i][j], nq_addr + i)
+                for c, i in cxs:
+                    circuit.cx(c, nq_addr + i)
+        else:
+            controls = self.cnot_schedule.controls.tolist()
+            for j in range(2**nq_addr):
+                for i in range(nq_data):
+                    circuit.ry(p[i][j], nq_addr + i)
+                for i in range(nq_data):
+                    circuit.cx(controls[j][i], nq_addr + i)
+            if self.keep_last_cx is False:
+                circuit.data.pop(slice(-1, -self.nq_data-1, -1))
         if self.reverse_bits:
-            self.circuit = self.circuit.reverse_bits()
+            circuit = circuit.reverse_bits()
         if measure:
-            self.circuit.measure_all()
-        if self.statevec:
-            self.circuit.save_statevector()
-        self._data = None
-        self._max_val = None
-        self._angles = None
-        self._angles_qcrank = None
+            circuit.measure_all()
+        return circuit
 
-    def transpile(self, *args, **kwargs):
-        self.circuit = transpile(self.circuit, *args, **kwargs)
+    def transpile(self, *args, cache=False, **kwargs):
+        '''Transpiles the parametrized circuit in place with
+        `qiskit.transpile`. With `cache=True` the result is stored in and
+        reused from the on-disk cache (see `datacircuits.cache`), keyed by
+        the circuit, the backend target and the transpiler options; the
+        backend is then the only positional argument.'''
+        if not cache:
+            self.circuit = transpile(self.circuit, *args, **kwargs)
+        elif len(args) > 1:
+            raise TypeError(
+                'transpile(cache=True) takes the backend as the only '
+                f'positional argument, got {len(args)}; pass the other '
+                'transpiler options by keyword'
+            )
+        else:
+            self.circuit = transpile_cached(self.circuit, *args, **kwargs)
 
-    def bind_data(self, data, max_val):
+    def bind_data(self, data, max_val, workers=None):
         '''Enables binding the QCRANK circuit to data
 
         Args:
@@ -196,8 +295,12 @@ class ParametrizedQCRANK:
                   * numpy array of size (2**nq_addr, nq_data)
                   * list of numpy arrays of size (2**nq_addr, nq_data)
                   * numpy array of size (2**nq_addr, nq_data, k)
+                a memory-mapped array is kept as is, it is not copied
             max_val:
                 maximum value of the discrete data
+            workers: int (None)
+                number of processes for transforming very large batches, see
+                `rotation_angles`
         '''
         if not isinstance(data, (np.ndarray, list)):
             raise RuntimeError('data should be either numpy array or list of '
@@ -213,15 +316,81 @@ class ParametrizedQCRANK:
                 '[(2**nq_addr, nq_data, k)]'
             )
         self._data = data
-        self._angles = rescale_data_to_angles(data, max_val)
-        self._angles_qcrank = np.empty(self._angles.shape)
-        for r in range(self._angles.shape[1]):
-            self._angles_qcrank[:, r] = shifted_gray_permutation(
-                sfwht(self._angles[:, r]),
-                r % self.nq_addr if self.parallel else 0
-            )
+        self._angles = rescale_data_to_angles(data, max_val, dtype=self.dtype)
+        self._angles_qcrank = rotation_angles(
+            self._angles, self.cnot_schedule.shifts, dtype=self.dtype,
+            workers=workers
+        )
         self._max_val = max_val
 
+    def build_bound(self, data, max_val, workers=None):
+        '''Binds the data and builds the circuits with numeric Ry angles,
+        without parameters and without `assign_parameters`. The gate sequence
+        is the one of `instantiate_circuits` on the untranspiled circuit; use
+        it for data that is encoded once.
+
+        Args:
+            see `bind_data`
+        Returns:
+            list of k circuits
+        '''
+        self.bind_data(data, max_val, workers=workers)
+        circs = []
+        for j in range(self.angles_qcrank.shape[2]):
+            circ = self._build_circuit(self._barrier, self._measure,
+                                       self.angles_qcrank[:, :, j])
+            if self.statevec:
+                circ.save_statevector()
+            circs.append(circ)
+        return circs
+
+    def build_compressed(self, data, max_val, tol=None, top_k=None,
+                         workers=None):
+        '''Binds the data and builds approximate circuits without the small
+        rotations: rotations with `|angle| <= tol`, or beyond the `top_k`
+        largest per data qubit, are dropped and the CNOTs between the
+        remaining rotations are merged (see `compressed_schedule`). Smooth
+        data has many small Walsh coefficients, so the circuits get much
+        shorter.
+
+        Args:
+            data, max_val, workers:
+                see `bind_data`
+            tol: float (None)
+                angle tolerance of the dropped rotations
+            top_k: int (None)
+                number of rotations kept per data qubit
+        Returns:
+            circs:
+                list of k circuits with numeric Ry angles
+            report: dict
+                * 'depth', 'num_ry', 'num_cx': (k,) arrays of the circuit
+                  depth and gate counts
+                * 'angle_err': (nq_data, k) bound of the error of every
+                  encoded angle
+                * 'data_err': (nq_data, k) the same bound in data units
+        '''
+        self.bind_data(data, max_val, workers=workers)
+        keep, angle_err = prune_rotation_angles(self.angles_qcrank, tol,
+                                                top_k)
+        circs = []
+        for j in range(self.angles_qcrank.shape[2]):
+            circ = self._build_circuit(self._barrier, self._measure,
+                                       self.angles_qcrank[:, :, j],
+                                       keep[:, :, j])
+            if self.statevec:
+                circ.save_statevector()
+            circs.append(circ)
+        ops = [c.count_ops() for c in circs]
+        report = {
+            'depth': np.array([c.depth() for c in circs]),
+            'num_ry': np.array([o.get('ry', 0) for o in ops]),
+            'num_cx': np.array([o.get('cx', 0) for o in ops]),
+            'angle_err': angle_err,
+            'data_err': rescale_angles_to_fdata(angle_err, max_val)
+        }
+        return circs, report
+
     @property
     def nq_addr(self):
         return self._nq_addr
@@ -261,7 +430,23 @@ class ParametrizedQCRANK:
             circs.append(circ)
         return circs
 
+    def parameter_table(self):
+        '''Returns the parametrized circuit and the parameter table of the
+        bound data, an array of size (k, num_parameters) ordered like
+        `circuit.parameters`. Unlike `instantiate_circuits`, no circuit copies
+        are made; the pair is a SamplerV2 PUB `(circuit, table)`.'''
+        if self.angles_qcrank is None:
+            raise RuntimeError('Parametrized QCRANK circuit is not yet binded '
+                               'to data. Run `bind_data` method first.`')
+        return self.circuit, parameter_table(
+            self.circuit.parameters, self.parameters, self.angles_qcrank
+        )
+
     @property
     def parameters(self):
         '''Returns the parameter vectors.'''
+        if self._p is None:
+            # re-attached from the circuit if it was cached
+            vectors = parameter_vectors(self.circuit)
+            self._p = [vectors[f'p{i}'] for i in range(self.nq_data)]
         return self._p
@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''Exact output distributions of the FRQI/QCRANK circuits.
+
+The encoders prepare a uniform superposition over the addresses with every
+data qubit d in `Ry(angles[a, d])|0>` conditioned on address a, so the
+outcome probabilities follow in closed form without simulating the circuit.
+The results are laid out like Qiskit counts, i.e. indexed by the integer
+value of the measured bitstring, and `sample_counts` turns them into shots.
+'''
+import numpy as np
+from ._util import CnotSchedule, _float_dtype
+from .frqi import FRQI
+from .neqr import ParametrizedNEQCRANK
+from .qcrank import ParametrizedQCRANK
+from .ParametricQCrankV2 import ParametricQCrankV2
+
+
+def _conditionals(angles, keep_last_cx, shifts):
+    '''Probabilities of data bit 1 per address, (2**nq_addr, nq_data, k).'''
+    angles = np.asarray(angles)
+    dtype = _float_dtype(angles)
+    angles = angles.astype(dtype, copy=False)
+    if angles.ndim == 2:
+        angles = angles[..., np.newaxis]
+    nq_addr = angles.shape[0].bit_length() - 1
+    if angles.shape[0] != 1 << nq_addr:
+        raise ValueError(f'Number of addresses {angles.shape[0]} is not a '
+                         'power of 2')
+    p1 = np.sin(angles / 2)**2
+    if keep_last_cx is False:
+        # the missing final CX flips data qubit d on the addresses where its
+        # control qubit is set
+        if shifts is None:
+            shifts = [d % nq_addr for d in range(angles.shape[1])]
+        controls = CnotSchedule(nq_addr, shifts).controls[-1]
+        a = np.arange(1 << nq_addr)[:, np.newaxis]
+        flip = (a >> (nq_addr - 1 - controls)) & 1 == 1
+        p1 = np.where(flip[..., np.newaxis], 1 - p1, p1)
+    return p1
+
+
+def distribution(angles, keep_last_cx=True, reverse_bits=False, shifts=None):
+    '''Exact outcome probabilities of a batch of encoded images.
+
+    Args:
+        angles:
+            Ry angles of the data qubits, array of size (2**nq_addr, nq_data,
+            k), or (2**nq_addr, k) for a single data qubit (FRQI). These are
+            the `angles` of `ParametrizedQCRANK`, `FRQI` and
+            `ParametricQCrankV2`, and twice those of `ParametrizedNEQCRANK`.
+        keep_last_cx: bool (True)
+            the circuit includes the final CX gates
+        reverse_bits: bool (False)
+            the circuit bits are reversed, address qubit 0 is the most
+            significant bit. This is also the layout of the reversed
+            measurement map of `ParametricQCrankV2`.
+        shifts: sequence of int (None)
+            CNOT shift per data qubit (see `CnotSchedule`), only used without
+            the final CX. Defaults to the parallel QCRANK shifts `d % nq_addr`.
+    Returns:
+        probabilities:
+            array of size (2**(nq_addr + nq_data), k), row i is the
+            probability of the bitstring with integer value i
+    '''
+    p1 = _conditionals(angles, keep_last_cx, shifts)
+    n_addr, nq_data, k = p1.shape
+    nq_addr = n_addr.bit_length() - 1
+    # one axis per qubit in circuit order, addresses first
+    dist = np.full((n_addr, k), 1 / n_addr, dtype=p1.dtype)
+    for d in range(nq_data):
+        pd = np.stack([1 - p1[:, d], p1[:, d]], axis=1)
+        pd = pd.reshape((n_addr,) + (1,) * d + (2, k))
+        dist = dist.reshape(dist.shape[:-1] + (1, k)) * pd
+    dist = dist.reshape((2,) * (nq_addr + nq_data) + (k,))
+    if not reverse_bits:
+        # Qiskit order: qubit 0 is the least significant bit
+        dist = dist.transpose(tuple(range(nq_addr + nq_data))[::-1] +
+                              (nq_addr + nq_data,))
+    return dist.reshape(-1, k)
+
+
+def marginals(angles, keep_last_cx=True, shifts=None):
+    '''Exact marginal distributions on the address qubits and every data
+    qubit, computed without the full distribution. Equal to
+    `address_data_marginals(distribution(angles, keep_last_cx,
+    reverse_bits=True, shifts=shifts), nq_addr, nq_data)`, i.e. the input the
+    QCRANK decoders expect.
+
+    Args:
+        see `distribution`
+    Returns:
+        marginals:
+            array of size (2**(nq_addr + 1), nq_data, k), row `a << 1 | b` is
+            the probability of address a with data bit b
+    '''
+    p1 = _conditionals(angles, keep_last_cx, shifts)
+    n_addr = p1.shape[0]
+    out = np.empty((n_addr, 2) + p1.shape[1:], dtype=p1.dtype)
+    out[:, 0] = (1 - p1) / n_addr
+    out[:, 1] = p1 / n_addr
+    return out.reshape((2 * n_addr,) + p1.shape[1:])
+
+
+def _encoder_args(encoder):
+    '''Angles and output options of a bound encoder.'''
+    if isinstance(encoder, ParametrizedQCRANK):
+        if encoder.angles is None:
+            raise RuntimeError('Parametrized QCRANK circuit is not yet binded '
+                               'to data. Run `bind_data` method first.`')
+        return (encoder.angles, encoder.keep_last_cx, encoder.reverse_bits,
+                encoder.cnot_schedule.shifts)
+    if isinstance(encoder, ParametrizedNEQCRANK):
+        if encoder.angles is None:
+            raise RuntimeError('Parametrized NEQCRANK circuit is not yet '
+                               'binded to data. Run `bind_data` method first.')
+        return (2 * encoder.angles, encoder.keep_last_cx,
+                encoder.reverse_bits, encoder.cnot_schedule.shifts)
+    if isinstance(encoder, FRQI):
+        return (encoder.angles[:, np.newaxis], encoder.keep_last_cx,
+                bool(encoder.reverse_bits), (0,))
+    if isinstance(encoder, ParametricQCrankV2):
+        # read from the build flags, the parametric circuit is built lazily
+        measure, _, _, mockCirc, addressH = encoder.buildArgs
+        if mockCirc or not addressH:
+            raise ValueError('ParametricQCrankV2 with mockCirc or without '
+                             'address Hadamards is not supported')
+        if getattr(encoder, 'angles_qcrank', None) is None:
+            raise RuntimeError('Parametrized QCRANKV2 circuit has not been '
+                               'bound to data. Run the `bind_data` method '
+                               'first.')
+        # measured qubits are mapped in reverse order, see ParametricQCrankV2
+        return (encoder.angles, True, measure, encoder.cnot_schedule.shifts)
+    raise TypeError(f'Unsupported encoder {type(encoder).__name__}')
+
+
+def encoder_distribution(encoder):
+    '''Exact outcome probabilities of the circuits of a bound
+    `ParametrizedQCRANK`, `ParametrizedNEQCRANK`, `ParametricQCrankV2` or
+    configured `FRQI`, see `distribution`.'''
+    angles, keep_last_cx, reverse_bits, shifts = _encoder_args(encoder)
+    return distribution(angles, keep_last_cx, reverse_bits, shifts)
+
+
+def encoder_marginals(encoder):
+    '''Exact address/data marginals of a bound encoder, see `marginals` and
+    `encoder_distribution`.'''
+    angles, keep_last_cx, _, shifts = _encoder_args(encoder)
+    return marginals(angles, keep_last_cx, shifts)
+
+
+def sample_counts(dist, shots, rng=None, packed=False):
+    '''Draws `shots` outcomes per image from exact distributions by
+    multinomial sampling, as an ideal shot-based simulator would.
+
+    Args:
+        dist:
+            probabilities of size (2**nqubits, k), see `distribution`
+        shots: int
+            number of shots per image
+        rng: (None)
+            `np.random.Generator` or seed
+        packed: bool (False)
+            return packed arrays instead of Qiskit counts dictionaries
+    Returns:
+        counts:
+            list of k Qiskit counts dictionaries `{bitstring: count}` or, if
+            `packed`, the tuple `(raw_ikey, raw_mshot, raw_nkey)` of int32
+            arrays in the layout of `pack_counts_to_numpy` of the cloud_job
+            toolbox: per image the outcomes sorted by decreasing count,
+            padded with -1 (keys) and 0 (counts), and the number of outcomes
+    '''
+    rng = np.random.default_rng(rng)
+    dist = np.asarray(dist, dtype=np.float64)
+    if dist.ndim == 1:
+        dist = dist[:, np.newaxis]
+    nqubits = dist.shape[0].bit_length() - 1
+    pvals = dist.T / dist.sum(axis=0)[:, np.newaxis]
+    mshot = rng.multinomial(shots, pvals)  # (k, 2**nqubits)
+    nkey = np.count_nonzero(mshot, axis=1)
+    if not packed:
+        fmt = f'0{nqubits}b'
+        return [
+            {format(i, fmt): int(m[i]) for i in np.flatnonzero(m)}
+            for m in mshot
+        ]
+    if nqubits > 31:
+        raise ValueError(f'{nqubits} qubits do not fit int32 keys')
+    order = np.argsort(-mshot, axis=1, kind='stable')[:, :max(nkey.max(), 1)]
+    raw_mshot = np.take_along_axis(mshot, order, axis=1).astype(np.int32)
+    raw_ikey = np.where(raw_mshot > 0, order, -1).astype(np.int32)
+    return raw_ikey, raw_mshot, nkey.astype(np.int32)
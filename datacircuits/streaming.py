@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from contextlib import contextmanager
+import numpy as np
+from ._util import rescale_data_to_angles, rotation_angles, resolve_dtype
+
+
+def open_source(source, key=None):
+    '''Opens a dataset for chunked reading without loading it into memory.
+
+    Args:
+        source:
+            numpy array (or memmap), h5py dataset, path to a `.npy` file
+            (opened memory-mapped) or path to an HDF5 file
+        key: str (None)
+            name of the dataset inside an HDF5 file
+    Returns:
+        array-like object supporting `shape` and slicing. For an HDF5 path
+        the caller owns the file, close it with `dataset.file.close()` or use
+        `opened_source`.
+    '''
+    if not isinstance(source, str):
+        return source
+    if source.endswith('.npy'):
+        return np.load(source, mmap_mode='r')
+    if source.endswith(('.h5', '.hdf5')):
+        try:
+            import h5py
+        except ImportError as e:
+            raise ImportError('Reading HDF5 sources requires h5py') from e
+        if key is None:
+            raise ValueError('A dataset key is needed for HDF5 sources')
+        fd = h5py.File(source, 'r')
+        try:
+            return fd[key]
+        except Exception:
+            fd.close()
+            raise
+    raise ValueError(f'Unsupported source {source}, expecting .npy or .h5')
+
+
+@contextmanager
+def opened_source(source, key=None):
+    '''Context manager of `open_source` that closes an HDF5 file it opened
+    on exit. Arrays and datasets passed in are left open.'''
+    src = open_source(source, key)
+    try:
+        yield src
+    finally:
+        if isinstance(source, str) and hasattr(src, 'file'):
+            src.file.close()
+
+
+def iter_angle_blocks(source, max_val, encoding='qcrank', chunk_size=64,
+                      parallel=True, key=None, out=None, dtype=None):
+    '''Streams the circuit angles of a dataset that is too large for memory.
+    Chunks of `chunk_size` images are read, scaled to angles, Walsh-Hadamard
+    transformed and Gray code permuted, so peak memory is bounded by the chunk
+    size rather than by the dataset size.
+
+    Args:
+        source:
+            dataset with images along the last axis (see `open_source`):
+              * QCRANK: size (2**nq_addr, nq_data, k)
+              * FRQI: size (2**nq_addr, k)
+        max_val:
+            maximum value of the discrete data
+        encoding: str ('qcrank')
+            'qcrank' or 'frqi'
+        chunk_size: int (64)
+            number of images per block
+        parallel: bool (True)
+            QCRANK with parallel (shifted) CNOTs, see `ParametrizedQCRANK`
+        key: str (None)
+            dataset name for HDF5 sources
+        out: (None)
+            optional array or memmap of the shape of the source; every block
+            is also written to it
+        dtype: (None)
+            float32 or float64 precision of the angles, package default if
+            None (see `set_default_dtype`)
+    Yields:
+        (images, angles):
+            slice of the images along the last axis and their angles
+    '''
+    dtype = resolve_dtype(dtype)
+    # an HDF5 file opened here is closed when the generator finishes or is
+    # closed
+    with opened_source(source, key) as src:
+        shape = src.shape
+        if encoding == 'qcrank':
+            nq_addr = int(np.log2(shape[0]))
+            shift = [r % nq_addr if parallel else 0 for r in range(shape[1])]
+        elif encoding == 'frqi':
+            shift = 0
+        else:
+            raise ValueError(f'Unknown encoding {encoding}')
+        if out is not None and out.shape != shape:
+            raise ValueError(f'Output of shape {out.shape} does not match '
+                             f'source of shape {shape}')
+        for start in range(0, shape[-1], chunk_size):
+            images = slice(start, min(start + chunk_size, shape[-1]))
+            chunk = np.asarray(src[..., images])
+            angles = rotation_angles(
+                rescale_data_to_angles(chunk, max_val, dtype=dtype), shift,
+                dtype=dtype
+            )
+            if out is not None:
+                out[..., images] = angles
+            yield images, angles
+
+
+def encode_to_memmap(source, out_path, max_val, encoding='qcrank',
+                     chunk_size=64, parallel=True, key=None,
+                     dtype=None):
+    '''Writes the circuit angles of a dataset to a memory-mapped `.npy` file
+    chunk by chunk, see `iter_angle_blocks` for the arguments.
+
+    Returns:
+        the memory-mapped output array
+    '''
+    dtype = resolve_dtype(dtype)
+    with opened_source(source, key) as src:
+        out = np.lib.format.open_memmap(
+            out_path, mode='w+', dtype=dtype, shape=src.shape
+        )
+        for _ in iter_angle_blocks(src, max_val, encoding=encoding,
+                                   chunk_size=chunk_size, parallel=parallel,
+                                   out=out, dtype=dtype):
+            pass
+    out.flush()
+    return out
@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''Encoding of images larger than one circuit.
+
+The images are cut into tiles of `2**nq_addr * nq_data` pixels, all tiles of
+all images are bound to the encoder in one batch, and the decoded tiles are
+stitched back into full images.
+'''
+import numpy as np
+from ._util import rescale_angles_to_fdata
+from .frqi import FRQI, ParametrizedFRQI, QKAtan2DecoderFRQI
+from .qcrank import ParametrizedQCRANK
+
+
+class TileLayout:
+    '''Splits images into equal tiles and stitches them back together.'''
+    def __init__(self, image_shape, tile_shape):
+        '''
+        Args:
+            image_shape: (int, int)
+                height and width of the images
+            tile_shape: (int, int)
+                height and width of the tiles, images whose size is not a
+                multiple of the tile size are zero padded
+        '''
+        self._image_shape = tuple(int(n) for n in image_shape)
+        self._tile_shape = tuple(int(n) for n in tile_shape)
+        if len(self._image_shape) != 2 or len(self._tile_shape) != 2:
+            raise ValueError('Image and tile shapes must be (height, width), '
+                             f'got {image_shape} and {tile_shape}')
+        self._grid = tuple(-(-n // t) for n, t in
+                           zip(self._image_shape, self._tile_shape))
+
+    @property
+    def image_shape(self):
+        return self._image_shape
+
+    @property
+    def tile_shape(self):
+        return self._tile_shape
+
+    @property
+    def grid(self):
+        '''Number of tiles along the height and the width.'''
+        return self._grid
+
+    @property
+    def num_tiles(self):
+        '''Number of tiles per image.'''
+        return self._grid[0] * self._grid[1]
+
+    def split(self, images):
+        '''Cuts images into tiles.
+
+        Args:
+            images:
+                array of size (height, width) or (height, width, k)
+        Returns:
+            tiles:
+                array of size (tile_height * tile_width, k * num_tiles), the
+                pixels of every tile in row-major order. Column
+                `(i * grid[0] + r) * grid[1] + c` is tile (r, c) of image i.
+        '''
+        images = np.asarray(images)
+        if images.ndim == 2:
+            images = images[..., np.newaxis]
+        if images.shape[:2] != self._image_shape:
+            raise RuntimeError(
+                f'Input images of incorrect shape {images.shape}, expecting '
+                f'{self._image_shape + (images.shape[-1],)} '
+                '[(height, width, k)]'
+            )
+        (gh, gw), (th, tw) = self._grid, self._tile_shape
+        k = images.shape[2]
+        pad = ((0, gh * th - images.shape[0]), (0, gw * tw - images.shape[1]),
+               (0, 0))
+        if any(p[1] for p in pad):
+            images = np.pad(images, pad)
+        tiles = images.reshape(gh, th, gw, tw, k).transpose(1, 3, 4, 0, 2)
+        return tiles.reshape(th * tw, k * gh * gw)
+
+    def stitch(self, tiles):
+        '''Reassembles images from their tiles, the inverse of `split`.
+
+        Args:
+            tiles:
+                array of size (tile_height * tile_width, k * num_tiles), or any
+                size whose leading axes hold the tile pixels in row-major order
+                and the last axis the tiles, e.g. (2**nq_addr, nq_data,
+                k * num_tiles) for QCRANK
+        Returns:
+            images of size (height, width, k)
+        '''
+        tiles = np.asarray(tiles)
+        (gh, gw), (th, tw) = self._grid, self._tile_shape
+        if tiles.shape[-1] % self.num_tiles:
+            raise RuntimeError(
+                f'{tiles.shape[-1]} tiles are not a multiple of the '
+                f'{self.num_tiles} tiles per image'
+            )
+        k = tiles.shape[-1] // self.num_tiles
+        images = tiles.reshape(th, tw, k, gh, gw).transpose(3, 0, 4, 1, 2)
+        images = images.reshape(gh * th, gw * tw, k)
+        return images[:self._image_shape[0], :self._image_shape[1]]
+
+
+def default_tile_shape(nq_addr, nq_data=1):
+    '''Tile of `2**nq_addr * nq_data` pixels, as square as possible: height
+    `2**ceil(nq_addr / 2)` and width `2**floor(nq_addr / 2) * nq_data`.'''
+    return 2**(nq_addr - nq_addr // 2), 2**(nq_addr // 2) * nq_data
+
+
+def encode_tiles(encoder, images, max_val, tile_shape=None):
+    '''Tiles images and binds all tiles of all images in one batch.
+
+    Args:
+        encoder:
+            `ParametrizedQCRANK` or `ParametrizedFRQI`
+        images:
+            array of size (height, width) or (height, width, k)
+        max_val:
+            maximum value of the discrete data
+        tile_shape: (int, int) (None)
+            tile of `2**nq_addr * nq_data` pixels (`nq_data = 1` for FRQI),
+            `default_tile_shape` if None
+    Returns:
+        bound:
+            the QCRANK encoder bound to the tiles, or the `FRQI` object of the
+            tiles (configure its output before generating circuits)
+        layout:
+            the `TileLayout`, circuit j encodes column j of `layout.split`
+    '''
+    if isinstance(encoder, ParametrizedQCRANK):
+        nq_data = encoder.nq_data
+    elif isinstance(encoder, ParametrizedFRQI):
+        nq_data = 1
+    else:
+        raise TypeError(f'Unsupported encoder {type(encoder).__name__}')
+    nq_addr = encoder.nq_addr
+    if tile_shape is None:
+        tile_shape = default_tile_shape(nq_addr, nq_data)
+    if tile_shape[0] * tile_shape[1] != 2**nq_addr * nq_data:
+        raise ValueError(
+            f'Tile {tile_shape} does not hold {2**nq_addr * nq_data} pixels '
+            '[2**nq_addr * nq_data]'
+        )
+    images = np.asarray(images)
+    layout = TileLayout(images.shape[:2], tile_shape)
+    tiles = layout.split(images)
+    if isinstance(encoder, ParametrizedFRQI):
+        return encoder(tiles, max_val), layout
+    encoder.bind_data(tiles.reshape(2**nq_addr, nq_data, -1), max_val)
+    return encoder, layout
+
+
+def decode_tiles(bound, results, layout, statevec=False):
+    '''Decodes the circuits of `encode_tiles` and stitches the images.
+
+    Args:
+        bound:
+            the bound encoder returned by `encode_tiles`
+        results:
+            yields (Qiskit counts or histograms, see the decoders) or, with
+            `statevec`, the state vectors of the circuits in tile order
+        layout:
+            the `TileLayout` returned by `encode_tiles`
+        statevec: bool (False)
+            decode state vectors instead of yields
+    Returns:
+        images of size (height, width, k) in data units (not rounded)
+    '''
+    if isinstance(bound, FRQI):
+        decoder = QKAtan2DecoderFRQI(bound)
+    else:
+        decoder = bound.decoder
+    if statevec:
+        angles = decoder.angles_from_statevec(results)
+    else:
+        angles = decoder.angles_from_yields(results)
+    return layout.stitch(rescale_angles_to_fdata(angles, bound.max_val))
@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import os
+from datacircuits import qcrank, frqi, cache
+from datacircuits.ParametricQCrankV2 import ParametricQCrankV2
+import numpy as np
+
+
+def test_template_cache(tmp_path, monkeypatch):
+    monkeypatch.setenv('DATACIRCUITS_CACHE_DIR', str(tmp_path))
+    nq_addr = 3
+    nq_data = 2
+    max_val = 16
+    data = np.random.randint(0, max_val, size=(2**nq_addr, nq_data, 2))
+
+    ref = qcrank.ParametrizedQCRANK(nq_addr, nq_data)
+    ref.bind_data(data, max_val)
+
+    # miss: the template is built and stored
+    first = qcrank.ParametrizedQCRANK(nq_addr, nq_data, cache=True)
+    assert len(os.listdir(tmp_path)) == 1
+    assert first.circuit.num_parameters == ref.circuit.num_parameters
+
+    # hit: the loaded template binds like the built one
+    second = qcrank.ParametrizedQCRANK(nq_addr, nq_data, cache=True)
+    second.bind_data(data, max_val)
+    for c_ref, c_hit in zip(ref.instantiate_circuits(),
+                            second.instantiate_circuits()):
+        assert c_ref == c_hit
+
+    # different flags are different templates
+    qcrank.ParametrizedQCRANK(nq_addr, nq_data, keep_last_cx=False,
+                              cache=True)
+    frqi.ParametrizedFRQI(nq_addr, cache=True)
+    ParametricQCrankV2(nq_addr, nq_data, useCache=True)
+    assert len(os.listdir(tmp_path)) == 4
+    v2 = ParametricQCrankV2(nq_addr, nq_data, useCache=True)
+    v2_ref = ParametricQCrankV2(nq_addr, nq_data)
+    v2.bind_data(data / max_val)
+    v2_ref.bind_data(data / max_val)
+    for c_ref, c_hit in zip(v2_ref.instantiate_circuits(),
+                            v2.instantiate_circuits()):
+        assert c_ref == c_hit
+
+    cache.evict(0)
+    assert os.listdir(tmp_path) == []
+
+
+def test_evict_lru(tmp_path, monkeypatch):
+    monkeypatch.setenv('DATACIRCUITS_CACHE_DIR', str(tmp_path))
+    keys = [cache.template_key(frqi.ParametrizedFRQI, nq_addr=n)
+            for n in (1, 2, 3)]
+    for t, (n, key) in enumerate(zip((1, 2, 3), keys)):
+        cache.save_template(key, frqi.ParametrizedFRQI(n)._circ)
+        path = os.path.join(tmp_path, key + '.qpy')
+        os.utime(path, (t, t))
+    # reading the oldest template makes it the most recently used one
+    assert cache.load_template(keys[0]) is not None
+    size = sum(os.path.getsize(os.path.join(tmp_path, f))
+               for f in os.listdir(tmp_path))
+    cache.evict(size - 1)
+    assert sorted(os.listdir(tmp_path)) == sorted(
+        [keys[0] + '.qpy', keys[2] + '.qpy']
+    )
+    assert cache.load_template(keys[1]) is None
+
+
+def test_transpile_cache(tmp_path, monkeypatch):
+    from qiskit.providers.fake_provider import GenericBackendV2
+    monkeypatch.setenv('DATACIRCUITS_CACHE_DIR', str(tmp_path))
+    nq_addr = 2
+    nq_data = 2
+    max_val = 16
+    data = np.random.randint(0, max_val, size=(2**nq_addr, nq_data, 2))
+    backend = GenericBackendV2(6, seed=1)
+    opts = dict(optimization_level=3, seed_transpiler=7)
+
+    ref = qcrank.ParametrizedQCRANK(nq_addr, nq_data)
+    ref.transpile(backend, cache=True, **opts)
+    key = cache.transpile_key(
+        qcrank.ParametrizedQCRANK(nq_addr, nq_data).circuit, backend, **opts
+    )
+    assert os.listdir(tmp_path) == [key + '.qpy']
+
+    # a new build of the same circuit hits the cache and binds as before
+    hit = qcrank.ParametrizedQCRANK(nq_addr, nq_data)
+    hit.transpile(backend, cache=True, **opts)
+    assert len(os.listdir(tmp_path)) == 1
+    # the layout is stored with the circuit, for harvest_circ_transpMeta
+    assert hit.circuit.layout.final_index_layout(filter_ancillas=True) == \
+        ref.circuit.layout.final_index_layout(filter_ancillas=True)
+    ref.bind_data(data, max_val)
+    hit.bind_data(data, max_val)
+    for c_ref, c_hit in zip(ref.instantiate_circuits(),
+                            hit.instantiate_circuits()):
+        assert c_ref == c_hit
+
+    # other seeds and targets are other entries
+    other = qcrank.ParametrizedQCRANK(nq_addr, nq_data)
+    other.transpile(GenericBackendV2(6, seed=2), cache=True, **opts)
+    assert len(os.listdir(tmp_path)) == 2
+    assert cache.backend_fingerprint(backend) != cache.backend_fingerprint(
+        GenericBackendV2(6, seed=2)
+    )
+
+
+def test_transpile_positional(tmp_path, monkeypatch):
+    monkeypatch.setenv('DATACIRCUITS_CACHE_DIR', str(tmp_path))
+    # without the cache the arguments go to qiskit.transpile unchanged
+    param_qcrank = qcrank.ParametrizedQCRANK(2, 2)
+    param_qcrank.transpile(None, ['cx', 'u'])
+    assert set(param_qcrank.circuit.count_ops()) <= {'cx', 'u', 'measure',
+                                                     'barrier'}
+    assert os.listdir(tmp_path) == []
+    try:
+        qcrank.ParametrizedQCRANK(2, 2).transpile(None, ['cx', 'u'],
+                                                  cache=True)
+    except TypeError:
+        pass
+    else:
+        raise AssertionError('transpile(cache=True) accepted options '
+                             'passed positionally')
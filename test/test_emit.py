@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import io
+import warnings
+from datacircuits import qcrank, emit
+from datacircuits.ParametricQCrankV2 import ParametricQCrankV2
+import numpy as np
+from qiskit import QuantumCircuit, qasm3, qpy
+
+
+def test_qasm3():
+    for nq_addr, nq_data in [(1, 1), (2, 3), (3, 2), (2, 11)]:
+        for reverse_bits in (True, False):
+            for keep_last_cx in (True, False):
+                for parallel in (True, False):
+                    param_qcrank = qcrank.ParametrizedQCRANK(
+                        nq_addr, nq_data, keep_last_cx=keep_last_cx,
+                        reverse_bits=reverse_bits, parallel=parallel
+                    )
+                    text = emit.qasm3_str(
+                        nq_addr, nq_data, reverse_bits=reverse_bits,
+                        keep_last_cx=keep_last_cx,
+                        shifts=param_qcrank.cnot_schedule.shifts
+                    )
+                    assert text == qasm3.dumps(param_qcrank.circuit)
+        for use_cz in (True, False):
+            qcrank_v2 = ParametricQCrankV2(nq_addr, nq_data, useCZ=use_cz)
+            text = emit.qasm3_str(nq_addr, nq_data, measure='reversed',
+                                  use_cz=use_cz)
+            assert text == qasm3.dumps(qcrank_v2.circuit)
+
+
+def _signature(circ):
+    return [(inst.operation.name,
+             tuple(circ.find_bit(q).index for q in inst.qubits),
+             tuple(str(p) for p in inst.operation.params))
+            for inst in circ.data]
+
+
+def test_qpy_segments():
+    nq_addr = 3
+    nq_data = 2
+    max_val = 16
+    param_qcrank = qcrank.ParametrizedQCRANK(nq_addr, nq_data, measure=False)
+    fd = io.BytesIO()
+    emit.write_qpy(fd, nq_addr, nq_data, gates_per_segment=7)
+    fd.seek(0)
+    with warnings.catch_warnings():
+        # segments only use part of each parameter vector
+        warnings.simplefilter('ignore', UserWarning)
+        segments = qpy.load(fd)
+    assert len(segments) > 1
+    assert all(len(s.data) <= 7 for s in segments)
+    circ = QuantumCircuit(nq_addr + nq_data)
+    for s in segments:
+        circ.compose(s, inplace=True)
+    assert _signature(circ) == _signature(param_qcrank.circuit)
+    # bound circuit from the angle tensor
+    param_qcrank.bind_data(
+        np.random.randint(0, max_val, size=(2**nq_addr, nq_data)), max_val
+    )
+    fd = io.BytesIO()
+    emit.write_qpy(fd, nq_addr, nq_data,
+                   angles=param_qcrank.angles_qcrank[:, :, 0])
+    fd.seek(0)
+    assert _signature(qpy.load(fd)[0]) == \
+        _signature(param_qcrank.instantiate_circuits()[0])
@@ -2,10 +2,10 @@
 # -*- coding: utf-8 -*-
 from datacircuits import frqi
 import numpy as np
-import qiskit as qk
+from qiskit_aer import AerSimulator
 
 
-simulator = qk.Aer.get_backend('aer_simulator')
+simulator = AerSimulator()
 
 
 def test_end_to_end():
@@ -79,3 +79,124 @@ def test_end_to_end():
     angles_rec = decoder.angles_from_yields(yields)
     data_rec = np.ravel(decoder.angles_to_data(angles_rec, max_val=max_val))
     np.testing.assert_allclose(data_rec, data, rtol=1e-12)
+
+
+def test_parameter_table():
+    nq_addr = 3
+    param_frqi = frqi.ParametrizedFRQI(nq_addr)
+    data = np.array([[0, 1, 2, 3, 4, 5, 6, 7], [7, 6, 5, 4, 3, 2, 1, 0]]).T
+    max_val = 8
+    data_frqi = param_frqi(data, max_val=max_val).configure_output(
+        keep_last_cx=False,
+        measure=False,
+        statevec=True,
+        reverse_bits=True
+    )
+    circ, table = data_frqi.parameter_table()
+    assert table.shape == (2, 2**nq_addr)
+    for row, ref in zip(table, data_frqi.generate_circuits()):
+        assert circ.assign_parameters(row) == ref
+
+
+def test_configure_output_view():
+    nq_addr = 3
+    param_frqi = frqi.ParametrizedFRQI(nq_addr)
+    data = np.arange(2**nq_addr)
+    data_frqi = param_frqi(data, max_val=8)
+    data_sv = data_frqi.configure_output(
+        keep_last_cx=False,
+        measure=False,
+        statevec=True,
+        reverse_bits=True
+    )
+    data_y = data_frqi.configure_output(
+        keep_last_cx=True,
+        measure=True,
+        statevec=False,
+        reverse_bits=False
+    )
+    # the views share the data and the angles
+    for view in (data_sv, data_y):
+        assert view.data is data_frqi.data
+        assert view.angles_frqi is data_frqi.angles_frqi
+    # the configured template is built once per view
+    assert data_sv.parametric_circuit() is data_sv.parametric_circuit()
+    assert data_sv.parametric_circuit() is not data_y.parametric_circuit()
+    assert data_y.parametric_circuit().num_clbits == nq_addr + 1
+    # the shared parametrized circuit is not modified
+    assert param_frqi.circuit.num_clbits == 0
+    assert param_frqi.circuit.count_ops()['cx'] == 2**nq_addr
+
+
+def test_decode_packed_yields():
+    from datacircuits import sim
+    from datacircuits._util import counts_to_histogram
+    nq_addr = 3
+    data = np.random.randint(0, 8, size=(2**nq_addr, 6))
+    data_frqi = frqi.ParametrizedFRQI(nq_addr)(data, max_val=8)
+    data_frqi = data_frqi.configure_output(
+        keep_last_cx=False,
+        measure=True,
+        statevec=False,
+        reverse_bits=True
+    )
+    dist = sim.encoder_distribution(data_frqi)
+    yields = sim.sample_counts(dist, 1000, rng=5)
+    packed = sim.sample_counts(dist, 1000, rng=5, packed=True)
+    decoder = frqi.QKAtan2DecoderFRQI(data_frqi)
+    ref = decoder.angles_from_yields(yields)
+    assert ref.shape == data.shape
+    np.testing.assert_allclose(decoder.angles_from_yields(packed), ref)
+    hist = counts_to_histogram(yields, nq_addr + 1)
+    np.testing.assert_allclose(
+        decoder.angles_from_yields(hist, is_numpy=True), ref
+    )
+    # exact distribution
+    np.testing.assert_allclose(
+        decoder.angles_to_data(
+            decoder.angles_from_yields(dist, is_numpy=True), max_val=8
+        ),
+        data
+    )
+
+
+def test_iter_circuits():
+    nq_addr = 3
+    param_frqi = frqi.ParametrizedFRQI(nq_addr)
+    data = np.random.randint(0, 8, size=(2**nq_addr, 5))
+    data_frqi = param_frqi(data, max_val=8).configure_output(
+        keep_last_cx=False,
+        measure=True,
+        statevec=False,
+        reverse_bits=True
+    )
+    circs = data_frqi.generate_circuits()
+    it = data_frqi.iter_circuits()
+    assert next(it) == circs[0]
+    assert list(it) == circs[1:]
+    batches = list(data_frqi.iter_circuits(batch_size=2))
+    assert [len(b) for b in batches] == [2, 2, 1]
+    assert sum(batches, []) == circs
+
+
+def test_build_compressed():
+    from qiskit.quantum_info import Statevector
+    nq_addr = 4
+    max_val = 32
+    data = np.round(16 + 12 * np.cos(np.linspace(0, np.pi, 2**nq_addr)))
+    data_frqi = frqi.ParametrizedFRQI(nq_addr)(data, max_val=max_val)
+    data_frqi = data_frqi.configure_output(
+        keep_last_cx=True,
+        measure=False,
+        statevec=False,
+        reverse_bits=True
+    )
+    circs, report = data_frqi.build_compressed(top_k=4)
+    assert report['num_ry'][0] == 4
+    assert report['num_cx'][0] < 2**nq_addr
+    full, _ = data_frqi.build_compressed()
+    assert full[0] == data_frqi.generate_circuits()[0]
+    # compare with the state of the full circuit: |<psi|phi>| >= cos(err/2)
+    overlap = np.abs(np.vdot(Statevector(circs[0]).data,
+                             Statevector(full[0]).data))
+    assert overlap >= np.cos(report['angle_err'][0] / 2) - 1e-12
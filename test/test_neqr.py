@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from datacircuits import neqr
+from datacircuits._util import counts_to_histogram
+import numpy as np
+from qiskit.quantum_info import Statevector
+from qiskit_aer import AerSimulator
+
+
+simulator = AerSimulator()
+
+
+def test_iter_from_data():
+    nq_addr = 2
+    nq_data = 3
+    data = np.array([[1, 5, 7, 2], [0, 3, 6, 4], [7, 7, 0, 1]]).T
+    neqr_mcx = neqr.NEQR_MCX(nq_addr, nq_data, measure=False)
+    circs = neqr_mcx.generate_from_data(data)
+    assert len(circs) == 3
+    # uniform superposition over |data[address]>|address> (Qiskit order)
+    for k, circ in enumerate(circs):
+        probs = Statevector(circ).probabilities()
+        idx = (data[:, k] << nq_addr) | np.arange(2**nq_addr)
+        np.testing.assert_allclose(probs[idx], 1 / 2**nq_addr, atol=1e-12)
+    assert list(neqr_mcx.iter_from_data(data)) == circs
+    batches = list(neqr_mcx.iter_from_data(data, batch_size=2))
+    assert [len(b) for b in batches] == [2, 1]
+    assert neqr_mcx.generate_from_data(list(data.T)) == circs
+    # the data is validated before the first circuit is requested
+    try:
+        neqr_mcx.iter_from_data(data + 1)
+    except RuntimeError:
+        pass
+    else:
+        raise AssertionError('iter_from_data accepted unnormalized data')
+
+
+def test_gray_order():
+    nq_addr = 4
+    nq_data = 3
+    data = np.random.randint(0, 2**nq_data, size=(2**nq_addr, 3))
+    data[::3, 1] = 0
+    data[:, 2] = 0
+    ref = neqr.NEQR_MCX(nq_addr, nq_data, measure=False)
+    neqr_mcx = neqr.NEQR_MCX(nq_addr, nq_data, measure=False,
+                             gray_order=True)
+    circs = neqr_mcx.generate_from_data(data)
+    for circ, c_ref in zip(circs, ref.generate_from_data(data)):
+        assert Statevector(circ).equiv(Statevector(c_ref))
+    counts = neqr_mcx.gate_counts(data)
+    counts_ref = neqr_mcx.gate_counts(data, gray_order=False)
+    for k, circ in enumerate(circs):
+        ops = circ.count_ops()
+        assert ops.get('x', 0) == counts['x'][k]
+        assert ops.get('mcx', 0) == counts['mcx'][k]
+    np.testing.assert_array_equal(counts['mcx'], counts_ref['mcx'])
+    np.testing.assert_array_equal(counts_ref['x'], nq_addr * 2**nq_addr)
+    assert np.all(counts['x'] <= 2**nq_addr + 2 * nq_addr - 1)
+    # an empty image needs no gates besides the diffusion
+    assert counts['x'][2] == 0 and counts['mcx'][2] == 0
+
+
+def test_neqcrank_end_to_end():
+    nq_addr = 2
+    nq_data = 3
+    data = np.array([[1, 2, 3, 4], [1, 5, 7, 2], [0, 6, 0, 7]]).T
+    for keep_last_cx in (True, False):
+        # state vectors
+        param_neqr = neqr.ParametrizedNEQCRANK(
+            nq_addr, nq_data, keep_last_cx=keep_last_cx, measure=False,
+            reverse_bits=True
+        )
+        param_neqr.bind_data(data)
+        circs = param_neqr.instantiate_circuits()
+        assert len(circs) == data.shape[1]
+        decoder = param_neqr.decoder
+        angles = decoder.angles_from_statevec(
+            [Statevector(c).data for c in circs]
+        )
+        assert angles.shape == (2**nq_addr, nq_data, data.shape[1])
+        np.testing.assert_array_equal(decoder.angles_to_data(angles), data)
+        # yields, as counts dictionaries and as sparse histogram
+        param_neqr = neqr.ParametrizedNEQCRANK(
+            nq_addr, nq_data, keep_last_cx=keep_last_cx, reverse_bits=True
+        )
+        param_neqr.bind_data(data)
+        circs = param_neqr.instantiate_circuits()
+        yields = [simulator.run(c, shots=1000, seed_simulator=3).result()
+                  .get_counts(c) for c in circs]
+        decoder = param_neqr.decoder
+        np.testing.assert_array_equal(
+            decoder.angles_to_data(decoder.angles_from_yields(yields)), data
+        )
+        hist = counts_to_histogram(yields, nq_addr + nq_data, sparse=True)
+        np.testing.assert_array_equal(
+            decoder.angles_to_data(decoder.angles_from_yields(hist)), data
+        )
@@ -8,6 +8,7 @@ Unit test
 import sys,os
 sys.path.append(os.path.abspath("/daan_qcrank1"))
 from datacircuits import qcrank
+from datacircuits._util import counts_to_histogram, parameter_binds
 import numpy as np
 
 from qiskit_aer import AerSimulator
@@ -106,6 +107,186 @@ def test_end_to_end():
     np.testing.assert_allclose(data_rec, np.ravel(data), rtol=1e-12)
 
 
+def test_sparse_yields():
+    nq_addr = 2
+    nq_data = 2
+    data = np.array([[0, 3, 5, 7], [1, 2, 4, 6]]).T
+    max_val = 8
+    param_qcrank = qcrank.ParametrizedQCRANK(
+        nq_addr,
+        nq_data,
+        qcrank.QKAtan2DecoderQCRANK,
+        keep_last_cx=False,
+        measure=True,
+        statevec=False,
+        reverse_bits=True
+    )
+    param_qcrank.bind_data(data, max_val)
+    data_circs = param_qcrank.instantiate_circuits()
+    results = [simulator.run(c, shots=2000).result() for c in data_circs]
+    yields = [r.get_counts(c) for r, c in zip(results, data_circs)]
+    hist = counts_to_histogram(yields, nq_addr + nq_data, sparse=True)
+    np.testing.assert_allclose(
+        param_qcrank.decoder.angles_from_yields(hist),
+        param_qcrank.decoder.angles_from_yields(yields),
+        rtol=1e-12
+    )
+
+
+def test_float32():
+    nq_addr = 3
+    nq_data = 2
+    data = np.array([[0, 1, 2, 3, 4, 5, 6, 7], [8, 9, 10, 11, 12, 13, 14, 15]])
+    data = data.T
+    max_val = 16
+    qcrank64 = qcrank.ParametrizedQCRANK(nq_addr, nq_data, measure=False,
+                                         statevec=True, reverse_bits=True)
+    qcrank64.bind_data(data, max_val)
+    qcrank32 = qcrank.ParametrizedQCRANK(nq_addr, nq_data, measure=False,
+                                         statevec=True, reverse_bits=True,
+                                         dtype=np.float32)
+    qcrank32.bind_data(data, max_val)
+    assert qcrank32.angles_qcrank.dtype == np.float32
+    # documented bound: nq_addr * 2**-24 * pi
+    np.testing.assert_allclose(qcrank32.angles_qcrank, qcrank64.angles_qcrank,
+                               rtol=0, atol=nq_addr * 2**-24 * np.pi)
+    data_circs = qcrank32.instantiate_circuits()
+    results = [simulator.run(c).result() for c in data_circs]
+    svecs = [r.get_statevector(c) for r, c in zip(results, data_circs)]
+    angles_rec = qcrank32.decoder.angles_from_statevec(svecs)
+    assert angles_rec.dtype == np.float32
+    data_rec = np.ravel(
+        qcrank32.decoder.angles_to_idata(angles_rec, max_val=max_val)
+    )
+    np.testing.assert_allclose(data_rec, np.ravel(data), rtol=1e-12)
+
+
+def test_bind_memmap(tmp_path):
+    nq_addr = 3
+    nq_data = 3
+    max_val = 16
+    data = np.random.randint(0, max_val, size=(2**nq_addr, nq_data, 5))
+    np.save(tmp_path / 'data.npy', data.astype(np.float64))
+    data_mm = np.load(tmp_path / 'data.npy', mmap_mode='r')
+    param_qcrank = qcrank.ParametrizedQCRANK(nq_addr, nq_data)
+    param_qcrank.bind_data(data_mm, max_val, workers=2)
+    assert param_qcrank.data is data_mm
+    ref = qcrank.ParametrizedQCRANK(nq_addr, nq_data)
+    ref.bind_data(data, max_val)
+    np.testing.assert_allclose(param_qcrank.angles_qcrank, ref.angles_qcrank,
+                               rtol=1e-12)
+
+
+def test_statevec_chunked(tmp_path):
+    from qiskit.quantum_info import Statevector
+    nq_addr = 3
+    nq_data = 3
+    max_val = 16
+    data = np.random.randint(0, max_val, size=(2**nq_addr, nq_data, 3))
+    param_qcrank = qcrank.ParametrizedQCRANK(nq_addr, nq_data, measure=False,
+                                             keep_last_cx=False,
+                                             reverse_bits=True)
+    param_qcrank.bind_data(data, max_val)
+    svecs = [Statevector(c) for c in param_qcrank.instantiate_circuits()]
+    decoder = param_qcrank.decoder
+    ref = decoder.angles_from_statevec([sv.data for sv in svecs])
+    np.testing.assert_allclose(ref, param_qcrank.angles, atol=1e-12)
+    for chunk_size in (None, 1, 3):
+        np.testing.assert_allclose(
+            decoder.angles_from_statevec(svecs, chunk_size=chunk_size), ref,
+            rtol=1e-12
+        )
+    # memory-mapped (2**(nq_addr + nq_data), k) array, read block by block
+    np.save(tmp_path / 'svecs.npy', np.stack([sv.data for sv in svecs], 1))
+    svecs_mm = np.load(tmp_path / 'svecs.npy', mmap_mode='r')
+    np.testing.assert_allclose(
+        decoder.angles_from_statevec(svecs_mm, chunk_size=2), ref, rtol=1e-12
+    )
+    # single state vector
+    np.testing.assert_allclose(
+        decoder.angles_from_statevec(svecs[0], chunk_size=4), ref[..., 0],
+        rtol=1e-12
+    )
+
+
+def test_build_bound():
+    nq_addr = 3
+    nq_data = 3
+    max_val = 16
+    data = np.random.randint(0, max_val, size=(2**nq_addr, nq_data, 3))
+    for kwargs in [{}, dict(keep_last_cx=False, reverse_bits=True),
+                   dict(parallel=False, barrier=False)]:
+        ref = qcrank.ParametrizedQCRANK(nq_addr, nq_data, **kwargs)
+        ref.bind_data(data, max_val)
+        param_qcrank = qcrank.ParametrizedQCRANK(nq_addr, nq_data, **kwargs)
+        circs = param_qcrank.build_bound(data, max_val)
+        # no parametric circuit is built
+        assert param_qcrank._circuit is None
+        assert len(circs) == data.shape[2]
+        for c_ref, circ in zip(ref.instantiate_circuits(), circs):
+            assert circ.num_parameters == 0
+            assert circ == c_ref
+        np.testing.assert_array_equal(param_qcrank.angles_qcrank,
+                                      ref.angles_qcrank)
+
+
+def test_build_compressed():
+    from qiskit.quantum_info import Statevector
+    nq_addr = 5
+    nq_data = 2
+    max_val = 64
+    x = np.linspace(0, 1, 2**nq_addr)
+    data = np.stack([
+        np.round((max_val - 1) * (0.5 + 0.4 * np.sin(2 * np.pi * x + ph)))
+        for ph in (0., 1.)
+    ], axis=1)
+    data = np.stack([data, data[::-1]], axis=2)
+    kwargs = dict(measure=False, keep_last_cx=False, reverse_bits=True)
+    full = qcrank.ParametrizedQCRANK(nq_addr, nq_data, **kwargs)
+    full_circs = full.build_bound(data, max_val)
+    # without pruning the circuits are unchanged
+    param_qcrank = qcrank.ParametrizedQCRANK(nq_addr, nq_data, **kwargs)
+    circs, report = param_qcrank.build_compressed(data, max_val, tol=-1)
+    assert all(c == c_ref for c, c_ref in zip(circs, full_circs))
+    np.testing.assert_array_equal(report['angle_err'], 0)
+    # pruned circuits are shorter and within the error bound
+    circs, report = param_qcrank.build_compressed(data, max_val, tol=0.01)
+    assert np.all(report['num_ry'] < 2**nq_addr * nq_data)
+    assert np.all(report['num_cx'] < full_circs[0].count_ops()['cx'])
+    assert np.all(report['depth'] < full_circs[0].depth())
+    angles_rec = param_qcrank.decoder.angles_from_statevec(
+        [Statevector(c).data for c in circs]
+    )
+    assert np.all(np.abs(angles_rec - param_qcrank.angles) <=
+                  report['angle_err'] + 1e-10)
+    np.testing.assert_allclose(
+        report['data_err'], report['angle_err'] * max_val / np.pi
+    )
+
+
+def test_parameter_table():
+    nq_addr = 2
+    nq_data = 11  # more than 10 vectors: p10 sorts before p2 by name
+    max_val = 16
+    data = np.random.randint(0, max_val, size=(2**nq_addr, nq_data, 3))
+    param_qcrank = qcrank.ParametrizedQCRANK(nq_addr, nq_data, measure=False,
+                                             statevec=True, reverse_bits=True)
+    param_qcrank.bind_data(data, max_val)
+    circ, table = param_qcrank.parameter_table()
+    assert circ is param_qcrank.circuit
+    assert table.shape == (3, circ.num_parameters)
+    for row, ref in zip(table, param_qcrank.instantiate_circuits()):
+        assert circ.assign_parameters(row) == ref
+    # a single Aer job over the whole table
+    result = simulator.run(
+        [circ], parameter_binds=parameter_binds(circ.parameters, table)
+    ).result()
+    svecs = [result.data(j)['statevector'] for j in range(3)]
+    angles_rec = param_qcrank.decoder.angles_from_statevec(svecs)
+    data_rec = param_qcrank.decoder.angles_to_idata(angles_rec, max_val)
+    np.testing.assert_equal(data_rec, data)
+
+
 def test_18_bug():
     nq_addr = 1
     nq_data = 8
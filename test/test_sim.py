@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from datacircuits import qcrank, frqi, neqr, sim
+from datacircuits._util import address_data_marginals
+from datacircuits.ParametricQCrankV2 import ParametricQCrankV2
+import numpy as np
+from qiskit.quantum_info import Statevector
+
+
+def _probabilities(circs):
+    return np.stack([Statevector(c).probabilities() for c in circs], axis=1)
+
+
+def test_qcrank_distribution():
+    nq_addr = 3
+    nq_data = 2
+    max_val = 16
+    data = np.random.randint(0, max_val, size=(2**nq_addr, nq_data, 2))
+    for reverse_bits in (True, False):
+        for keep_last_cx in (True, False):
+            param_qcrank = qcrank.ParametrizedQCRANK(
+                nq_addr, nq_data, measure=False, keep_last_cx=keep_last_cx,
+                reverse_bits=reverse_bits
+            )
+            param_qcrank.bind_data(data, max_val)
+            ref = _probabilities(param_qcrank.instantiate_circuits())
+            dist = sim.encoder_distribution(param_qcrank)
+            np.testing.assert_allclose(dist, ref, atol=1e-12)
+            if reverse_bits:
+                np.testing.assert_allclose(
+                    sim.encoder_marginals(param_qcrank),
+                    address_data_marginals(ref, nq_addr, nq_data),
+                    atol=1e-12
+                )
+                angles_rec = param_qcrank.decoder.angles_from_yields(
+                    dist, is_numpy=True
+                )
+                np.testing.assert_allclose(angles_rec, param_qcrank.angles,
+                                           atol=1e-12)
+
+
+def test_frqi_neqr_distribution():
+    nq_addr = 3
+    nq_data = 3
+    data = np.random.randint(0, 2**nq_data, size=(2**nq_addr, 2))
+    for keep_last_cx in (True, False):
+        data_frqi = frqi.ParametrizedFRQI(nq_addr)(data, 8).configure_output(
+            keep_last_cx=keep_last_cx,
+            measure=False,
+            statevec=False,
+            reverse_bits=True
+        )
+        np.testing.assert_allclose(
+            sim.encoder_distribution(data_frqi),
+            _probabilities(data_frqi.generate_circuits()), atol=1e-12
+        )
+        param_neqr = neqr.ParametrizedNEQCRANK(
+            nq_addr, nq_data, measure=False, keep_last_cx=keep_last_cx
+        )
+        param_neqr.bind_data(data)
+        np.testing.assert_allclose(
+            sim.encoder_distribution(param_neqr),
+            _probabilities(param_neqr.instantiate_circuits()), atol=1e-12
+        )
+
+
+def test_qcrank_v2_distribution():
+    nq_addr = 2
+    nq_data = 3
+    data = np.random.uniform(-1, 1, size=(2**nq_addr, nq_data, 2))
+    qcrank_v2 = ParametricQCrankV2(nq_addr, nq_data, measure=False,
+                                   useCZ=True)
+    qcrank_v2.bind_data(data)
+    np.testing.assert_allclose(
+        sim.encoder_distribution(qcrank_v2),
+        _probabilities(qcrank_v2.instantiate_circuits()), atol=1e-12
+    )
+    # measurements map qubit i to clbit nq_addr + nq_data - 1 - i
+    qcrank_v2 = ParametricQCrankV2(nq_addr, nq_data)
+    qcrank_v2.bind_data(data)
+    circ = qcrank_v2.instantiate_circuits()[0]
+    ref = Statevector(circ.remove_final_measurements(inplace=False))
+    ref = ref.probabilities_dict()
+    dist = sim.encoder_distribution(qcrank_v2)
+    n = nq_addr + nq_data
+    for key, p in ref.items():
+        # Statevector keys are little-endian in the qubits
+        np.testing.assert_allclose(dist[int(key[::-1], 2), 0], p, atol=1e-12)
+    # expectation values <Z> of the data qubits are the data
+    marg = sim.encoder_marginals(qcrank_v2).reshape(2**nq_addr, 2, nq_data, 2)
+    np.testing.assert_allclose(
+        2**nq_addr * (marg[:, 0] - marg[:, 1]), data, atol=1e-12
+    )
+    assert dist.shape == (2**n, 2)
+    # the distribution does not need the parametric circuit
+    qcrank_v2 = ParametricQCrankV2(nq_addr, nq_data)
+    qcrank_v2.bind_data(data)
+    np.testing.assert_allclose(sim.encoder_distribution(qcrank_v2), dist)
+    assert qcrank_v2._circuit is None
+    # without address Hadamards the addresses are not in superposition
+    qcrank_v2 = ParametricQCrankV2(nq_addr, nq_data, addressH=False)
+    qcrank_v2.bind_data(data)
+    try:
+        sim.encoder_distribution(qcrank_v2)
+    except ValueError:
+        pass
+    else:
+        raise AssertionError('addressH=False was accepted')
+
+
+def test_sample_counts():
+    nq_addr = 2
+    nq_data = 2
+    max_val = 16
+    shots = 100_000
+    data = np.random.randint(0, max_val, size=(2**nq_addr, nq_data, 3))
+    param_qcrank = qcrank.ParametrizedQCRANK(nq_addr, nq_data,
+                                             reverse_bits=True)
+    param_qcrank.bind_data(data, max_val)
+    dist = sim.encoder_distribution(param_qcrank)
+    counts = sim.sample_counts(dist, shots, rng=7)
+    assert all(sum(c.values()) == shots for c in counts)
+    angles_rec = param_qcrank.decoder.angles_from_yields(counts)
+    data_rec = param_qcrank.decoder.angles_to_idata(angles_rec, max_val)
+    np.testing.assert_equal(data_rec, data)
+    # packed layout, same draws for the same seed
+    raw_ikey, raw_mshot, raw_nkey = sim.sample_counts(dist, shots, rng=7,
+                                                      packed=True)
+    assert raw_ikey.dtype == np.int32 and raw_ikey.shape == raw_mshot.shape
+    for ic, c in enumerate(counts):
+        nkey = raw_nkey[ic]
+        assert nkey == len(c)
+        assert np.all(np.diff(raw_mshot[ic, :nkey]) <= 0)
+        assert np.all(raw_ikey[ic, nkey:] == -1)
+        assert {format(k, '04b'): m for k, m in
+                zip(raw_ikey[ic, :nkey], raw_mshot[ic, :nkey])} == c
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from datacircuits import qcrank, frqi, streaming
+import numpy as np
+
+
+def test_qcrank_blocks(tmp_path):
+    nq_addr = 3
+    nq_data = 2
+    max_val = 16
+    rng = np.random.default_rng(0)
+    data = rng.integers(0, max_val, size=(2**nq_addr, nq_data, 10))
+    src = str(tmp_path / 'data.npy')
+    np.save(src, data)
+
+    param_qcrank = qcrank.ParametrizedQCRANK(nq_addr, nq_data)
+    param_qcrank.bind_data(data, max_val)
+
+    blocks = list(streaming.iter_angle_blocks(src, max_val, chunk_size=4))
+    assert [b[1].shape[-1] for b in blocks] == [4, 4, 2]
+    angles = np.concatenate([b[1] for b in blocks], axis=-1)
+    np.testing.assert_allclose(angles, param_qcrank.angles_qcrank, rtol=1e-12)
+
+    out = streaming.encode_to_memmap(
+        src, str(tmp_path / 'angles.npy'), max_val, chunk_size=3
+    )
+    np.testing.assert_allclose(
+        np.load(str(tmp_path / 'angles.npy')), param_qcrank.angles_qcrank,
+        rtol=1e-12
+    )
+    assert isinstance(out, np.memmap)
+
+
+def test_frqi_blocks():
+    nq_addr = 3
+    max_val = 8
+    data = np.stack([np.arange(8), np.arange(8)[::-1]], axis=1)
+    data_frqi = frqi.ParametrizedFRQI(nq_addr)(data, max_val)
+    blocks = list(streaming.iter_angle_blocks(
+        data, max_val, encoding='frqi', chunk_size=1
+    ))
+    angles = np.concatenate([b[1] for b in blocks], axis=-1)
+    np.testing.assert_allclose(angles, data_frqi.angles_frqi, rtol=1e-12)
+
+
+def test_default_dtype(tmp_path):
+    from datacircuits import set_default_dtype
+    data = np.random.randint(0, 8, size=(8, 2, 5))
+    src = str(tmp_path / 'data.npy')
+    np.save(src, data)
+    set_default_dtype(np.float32)
+    try:
+        param_qcrank = qcrank.ParametrizedQCRANK(3, 2)
+        param_qcrank.bind_data(data, 8)
+        _, angles = next(streaming.iter_angle_blocks(src, 8))
+        assert angles.dtype == param_qcrank.angles_qcrank.dtype == np.float32
+        out = streaming.encode_to_memmap(src, str(tmp_path / 'a.npy'), 8)
+        assert out.dtype == np.float32
+        np.testing.assert_allclose(out, param_qcrank.angles_qcrank,
+                                   rtol=1e-6)
+    finally:
+        set_default_dtype(np.float64)
+
+
+def test_hdf5_source(tmp_path):
+    import pytest
+    h5py = pytest.importorskip('h5py')
+
+    def open_files():
+        # open files and datasets, a dataset keeps its file open
+        return h5py.h5f.get_obj_count(
+            h5py.h5f.OBJ_ALL, h5py.h5f.OBJ_FILE | h5py.h5f.OBJ_DATASET
+        )
+
+    data = np.random.randint(0, 16, size=(8, 2, 5))
+    src = str(tmp_path / 'data.h5')
+    with h5py.File(src, 'w') as fd:
+        fd['images'] = data
+    param_qcrank = qcrank.ParametrizedQCRANK(3, 2)
+    param_qcrank.bind_data(data, 16)
+    blocks = streaming.iter_angle_blocks(src, 16, chunk_size=2, key='images')
+    angles = np.concatenate([b[1] for b in blocks], axis=-1)
+    np.testing.assert_allclose(angles, param_qcrank.angles_qcrank, rtol=1e-12)
+    assert open_files() == 0
+    out = streaming.encode_to_memmap(src, str(tmp_path / 'angles.npy'), 16,
+                                     key='images')
+    np.testing.assert_allclose(out, param_qcrank.angles_qcrank, rtol=1e-12)
+    assert open_files() == 0
+    # an abandoned generator closes the file too
+    blocks = streaming.iter_angle_blocks(src, 16, chunk_size=2, key='images')
+    next(blocks)
+    assert open_files() > 0
+    blocks.close()
+    assert open_files() == 0
+    with streaming.opened_source(src, 'images') as dset:
+        assert dset.shape == data.shape
+    assert open_files() == 0
@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from datacircuits import frqi, qcrank, tiling
+import numpy as np
+from qiskit.quantum_info import Statevector
+
+
+def test_split_stitch():
+    images = np.random.randint(0, 256, size=(13, 10, 3))
+    layout = tiling.TileLayout(images.shape[:2], (4, 8))
+    assert layout.grid == (4, 2)
+    tiles = layout.split(images)
+    assert tiles.shape == (32, 3 * 8)
+    # tile (r, c) = (1, 1) of image 2, zero padded beyond the width
+    ref = np.zeros((4, 8), dtype=images.dtype)
+    ref[:, :2] = images[4:8, 8:10, 2]
+    np.testing.assert_array_equal(tiles[:, (2 * 4 + 1) * 2 + 1], ref.ravel())
+    np.testing.assert_array_equal(layout.stitch(tiles), images)
+    np.testing.assert_array_equal(
+        layout.stitch(tiles.reshape(8, 4, -1)), images
+    )
+
+
+def test_tiled_qcrank():
+    nq_addr = 3
+    nq_data = 2
+    max_val = 16
+    images = np.random.randint(0, max_val, size=(12, 10, 2))
+    param_qcrank = qcrank.ParametrizedQCRANK(
+        nq_addr, nq_data, measure=False, keep_last_cx=False,
+        reverse_bits=True
+    )
+    bound, layout = tiling.encode_tiles(param_qcrank, images, max_val)
+    assert layout.tile_shape == (4, 4)
+    assert bound.angles_qcrank.shape[2] == 2 * layout.num_tiles
+    svecs = [Statevector(c).data for c in bound.instantiate_circuits()]
+    images_rec = tiling.decode_tiles(bound, svecs, layout, statevec=True)
+    np.testing.assert_allclose(images_rec, images, atol=1e-9)
+
+
+def test_tiled_frqi():
+    nq_addr = 4
+    max_val = 32
+    images = np.random.randint(0, max_val, size=(9, 7))
+    bound, layout = tiling.encode_tiles(
+        frqi.ParametrizedFRQI(nq_addr), images, max_val, tile_shape=(2, 8)
+    )
+    bound = bound.configure_output(
+        keep_last_cx=True,
+        measure=False,
+        statevec=False,
+        reverse_bits=True
+    )
+    svecs = [Statevector(c).data for c in bound.generate_circuits()]
+    images_rec = tiling.decode_tiles(bound, svecs, layout, statevec=True)
+    np.testing.assert_allclose(images_rec[..., 0], images, atol=1e-9)
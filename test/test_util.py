@@ -1,6 +1,9 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 from datacircuits._util import (
+    unpack_bitplanes,
+    pack_bitplanes,
+    rescale_angles_to_bit_to_data,
     next_pow2,
     circular_bit_shift,
     gray_code,
@@ -9,16 +12,50 @@ from datacircuits._util import (
     inv_gray_permutation,
     shifted_gray_permutation,
     shifted_inv_gray_permutation,
+    gray_permutation_table,
+    apply_gray_permutation,
     sfwht,
     isfwht,
+    walsh_hadamard,
+    rotation_angles,
     compute_control,
+    CnotSchedule,
     rescale_data_to_angles,
-    rescale_angles_to_data,
+    set_default_dtype,
+    get_default_dtype,
+    rescale_angles_to_fdata as rescale_angles_to_data,
     convert_shots_to_pdf,
+    counts_to_histogram,
     cnot_permutation,
-    marginal_distribution
+    get_bits,
+    marginal_distribution,
+    gather_bits,
+    gather_bits_table,
+    address_data_marginals,
+    prune_rotation_angles,
+    compressed_schedule,
+    batched,
+    packed_counts_to_histogram
 )
 import numpy as np
+import scipy.sparse
+
+
+def test_bitplanes():
+    data = np.array([[1, 5, 7, 2], [0, 65535, 256, 3]]).T
+    bits = unpack_bitplanes(data, 16)
+    assert bits.shape == (4, 16, 2)
+    np.testing.assert_array_equal(bits[1, :4, 0], [1, 0, 1, 0])
+    np.testing.assert_array_equal(pack_bitplanes(bits), data)
+    angles = np.where(unpack_bitplanes(data[:, 0], 3) == 1, np.pi / 2, 0)
+    np.testing.assert_array_equal(
+        rescale_angles_to_bit_to_data(angles), data[:, 0]
+    )
+    # decoded angles carry float noise around 0 and pi/2
+    noise = np.random.default_rng(0).normal(scale=1e-9, size=angles.shape)
+    np.testing.assert_array_equal(
+        rescale_angles_to_bit_to_data(np.abs(angles + noise)), data[:, 0]
+    )
 
 
 def test_next_pow2():
@@ -150,6 +187,22 @@ def test_shifted_gray_permutation():
     np.testing.assert_array_equal(a, c)
 
 
+def test_apply_gray_permutation():
+    idx = gray_permutation_table(3, 1)
+    np.testing.assert_array_equal(idx, [0, 4, 5, 1, 3, 7, 6, 2])
+    assert gray_permutation_table(3, 4) is idx  # shift mod n, cached
+    assert not idx.flags.writeable
+    # one shift per data column of a (2**n, nq_data, k) tensor
+    a = np.arange(8 * 3 * 2).reshape(8, 3, 2)
+    b = apply_gray_permutation(a, [0, 1, 2])
+    for r in range(3):
+        np.testing.assert_array_equal(
+            b[:, r], shifted_gray_permutation(a[:, r], r)
+        )
+    c = apply_gray_permutation(b, [0, 1, 2], inverse=True)
+    np.testing.assert_array_equal(c, a)
+
+
 def test_sfwht():
     a = np.array([0, 1, 2, 3, 4, 5, 6, 7], dtype=np.float64)
     b = sfwht(a)
@@ -161,6 +214,64 @@ def test_sfwht():
     np.testing.assert_allclose(a_rec, a, rtol=1e-12)
 
 
+def test_walsh_hadamard():
+    rng = np.random.default_rng(0)
+    a = rng.uniform(size=(16, 3, 4))
+    ref = np.empty_like(a)
+    for i in range(a.shape[1]):
+        for j in range(a.shape[2]):
+            ref[:, i, j] = _sfwht_ref(a[:, i, j])
+    np.testing.assert_allclose(walsh_hadamard(a), ref, rtol=1e-12)
+    np.testing.assert_allclose(sfwht(a), ref, rtol=1e-12)
+    # transform along a different axis
+    b = sfwht(np.moveaxis(a, 0, 2), axis=2)
+    np.testing.assert_allclose(np.moveaxis(b, 2, 0), ref, rtol=1e-12)
+    # in-place and out= operation
+    c = a.copy()
+    assert sfwht(c, out=c) is c
+    np.testing.assert_allclose(c, ref, rtol=1e-12)
+    out = np.empty((3, 16, 4))[:, ::1].transpose(1, 0, 2)
+    isfwht(ref, out=out)
+    np.testing.assert_allclose(out, a, rtol=1e-12)
+    # float32 precision
+    d = sfwht(a, dtype=np.float32)
+    assert d.dtype == np.float32
+    np.testing.assert_allclose(d, ref, rtol=1e-5, atol=1e-6)
+
+
+def test_rotation_angles():
+    rng = np.random.default_rng(1)
+    a = rng.uniform(size=(16, 3, 7))
+    shifts = [0, 1, 2]
+    ref = np.empty_like(a)
+    for r in range(3):
+        ref[:, r] = shifted_gray_permutation(sfwht(a[:, r]), r)
+    np.testing.assert_allclose(rotation_angles(a, shifts), ref, rtol=1e-12)
+    # images split over a process pool
+    np.testing.assert_allclose(
+        rotation_angles(a, shifts, workers=3), ref, rtol=1e-12
+    )
+
+
+def _sfwht_ref(a):
+    N = a.shape[0]
+    b = np.copy(a)
+    h = 1
+    while h < N:
+        for i in range(0, N, 2 * h):
+            for j in range(i, i + h):
+                x, y = b[j], b[j + h]
+                b[j], b[j + h] = (x + y) / 2., (x - y) / 2.
+        h *= 2
+    return b
+
+
+def test_batched():
+    assert list(batched(range(5))) == [0, 1, 2, 3, 4]
+    assert list(batched(range(5), 2)) == [[0, 1], [2, 3], [4]]
+    assert list(batched(iter([]), 3)) == []
+
+
 def test_compute_control():
     ctrl_ref = [2, 1, 2, 0, 2, 1, 2, 0]
     shift = [0, 1, 2]
@@ -169,6 +280,46 @@ def test_compute_control():
             assert compute_control(i, 3, s) == (ctrl_ref[i] + s) % 3
 
 
+def test_cnot_schedule():
+    for n in range(1, 6):
+        schedule = CnotSchedule(n, range(n))
+        assert schedule.controls.shape == (2**n, n)
+        for i in range(2**n):
+            for s in range(n):
+                assert schedule.controls[i, s] == compute_control(i, n, s)
+    assert CnotSchedule(3, [0, 1]).controls is CnotSchedule(3, (0, 1)).controls
+
+
+def test_prune_rotation_angles():
+    angles = np.array([[0.5, -0.01], [0.02, 0.3], [-0.2, 0.], [0.01, -0.4]])
+    keep, err = prune_rotation_angles(angles, tol=0.015)
+    np.testing.assert_array_equal(
+        keep, [[True, False], [True, True], [True, False], [False, True]]
+    )
+    np.testing.assert_allclose(err, [0.01, 0.01])
+    keep, err = prune_rotation_angles(angles, top_k=1)
+    np.testing.assert_array_equal(keep.sum(axis=0), [1, 1])
+    assert keep[0, 0] and keep[3, 1]
+    np.testing.assert_allclose(err, [0.23, 0.31])
+
+
+def test_compressed_schedule():
+    controls = CnotSchedule(3, [0, 1]).controls
+    full = list(compressed_schedule(controls, np.ones((8, 2), dtype=bool)))
+    for j, (rys, cxs) in enumerate(full):
+        assert rys == [0, 1]
+        assert cxs == [(controls[j, 0], 0), (controls[j, 1], 1)]
+    # only the first rotations: the full CNOT cycle cancels
+    keep = np.zeros((8, 2), dtype=bool)
+    keep[0] = True
+    sched = list(compressed_schedule(controls, keep))
+    assert sched[0] == ([0, 1], [])
+    assert all(cxs == [] for _, cxs in sched)
+    # without the last CNOTs, the remaining cycle acts as the omitted one
+    sched = list(compressed_schedule(controls, keep, keep_last_cx=False))
+    assert sched[-1] == ([], [(controls[-1, 0], 0), (controls[-1, 1], 1)])
+
+
 def test_convert_data_angles():
     data = np.array([16., 45., 32., 0., 63., 22., 51., 7.])
     angles = rescale_data_to_angles(data, max_val=64)
@@ -176,6 +327,19 @@ def test_convert_data_angles():
     np.testing.assert_allclose(data, data_rec, rtol=1e-12)
 
 
+def test_default_dtype():
+    data = np.array([16, 45, 32, 0])
+    assert rescale_data_to_angles(data, max_val=64).dtype == np.float64
+    set_default_dtype(np.float32)
+    try:
+        assert get_default_dtype() == np.float32
+        assert rescale_data_to_angles(data, max_val=64).dtype == np.float32
+        assert sfwht(data).dtype == np.float32
+        assert counts_to_histogram({'00': 4}).dtype == np.float32
+    finally:
+        set_default_dtype(np.float64)
+
+
 def test_convert_shots_to_pdf():
     shots = {'00': 4, '10': 16}
     ref = [4, 0, 16, 0]
@@ -186,6 +350,48 @@ def test_convert_shots_to_pdf():
     np.testing.assert_allclose(pdf, ref_norm, rtol=1e-12)
 
 
+def test_counts_to_histogram():
+    yields = [{'00': 4, '10': 16}, {'11': 3, '01': 1}]
+    ref = np.array([[4, 0], [0, 1], [16, 0], [0, 3]])
+    np.testing.assert_array_equal(counts_to_histogram(yields), ref)
+    np.testing.assert_allclose(
+        counts_to_histogram(yields, 2, normalize=True), ref / ref.sum(axis=0)
+    )
+    hist = counts_to_histogram(yields, 2, sparse=True)
+    assert hist.shape == (4, 2) and hist.nnz == 4
+    np.testing.assert_array_equal(hist.toarray(), ref)
+    # integer keys and register separators
+    np.testing.assert_array_equal(
+        counts_to_histogram([{0: 4, 2: 16}, {'1 1': 3, '0 1': 1}], 2), ref
+    )
+    # sparse histograms marginalize like dense ones
+    rng = np.random.default_rng(3)
+    dense = rng.integers(0, 3, size=(32, 2)).astype(float)
+    np.testing.assert_array_equal(
+        address_data_marginals(dense, 2, 3),
+        address_data_marginals(scipy.sparse.csc_array(dense), 2, 3)
+    )
+
+
+def test_packed_counts_to_histogram():
+    # keys sorted by count and padded with -1, as pack_counts_to_numpy
+    ikey = np.array([[2, 0], [3, 1]])
+    mshot = np.array([[16, 4], [3, 1]])
+    ref = np.array([[4, 0], [0, 1], [16, 0], [0, 3]])
+    np.testing.assert_array_equal(
+        packed_counts_to_histogram(ikey, mshot, 2), ref
+    )
+    ikey = np.array([[2, 0, -1], [3, 1, -1]])
+    mshot = np.array([[16, 4, 0], [3, 1, 0]])
+    np.testing.assert_allclose(
+        packed_counts_to_histogram(ikey, mshot, 2, normalize=True),
+        ref / ref.sum(axis=0)
+    )
+    hist = packed_counts_to_histogram(ikey, mshot, 2, sparse=True)
+    assert hist.nnz == 4
+    np.testing.assert_array_equal(hist.toarray(), ref)
+
+
 def test_cnot_permutation():
     # 2 qubits
     dist = np.array([0, 1, 2, 3])
@@ -203,6 +409,24 @@ def test_cnot_permutation():
     np.testing.assert_array_equal(dist02, np.array([0, 1, 2, 3, 5, 4, 7, 6]))
 
 
+def test_cnot_permutation_batched():
+    rng = np.random.default_rng(2)
+    dist = rng.uniform(size=(16, 3, 5))
+    ref = np.stack(
+        [cnot_permutation(dist[:, i], i, 3) for i in range(3)], axis=1
+    )
+    np.testing.assert_array_equal(cnot_permutation(dist, [0, 1, 2], 3), ref)
+    # single control, in-place along a non-leading axis
+    d = np.ascontiguousarray(np.moveaxis(dist, 0, 2))
+    assert cnot_permutation(d, 1, 3, axis=2, inplace=True) is d
+    np.testing.assert_array_equal(
+        np.moveaxis(d, 2, 0), cnot_permutation(dist, 1, 3)
+    )
+    d = dist.copy()
+    cnot_permutation(d, [0, 1, 2], 3, inplace=True)
+    np.testing.assert_array_equal(d, ref)
+
+
 def test_marginal_distribution():
     # 2 qubits
     dist = np.array([0, 1, 5, 2])
@@ -235,3 +459,35 @@ def test_marginal_distribution():
     dist012 = dist01 = marginal_distribution(dist, [0, 1, 2])
     ref012 = np.array([24])
     np.testing.assert_array_equal(dist012, ref012)
+
+
+def test_address_data_marginals():
+    nq_addr, nq_data = 2, 3
+    rng = np.random.default_rng(1)
+    dist = rng.integers(0, 100, size=(2**(nq_addr + nq_data), 4))
+    out = address_data_marginals(dist, nq_addr, nq_data)
+    assert out.shape == (2**(nq_addr + 1), nq_data, 4)
+    for i in range(nq_data):
+        t_out = [k + nq_addr for k in range(nq_data) if k != i]
+        np.testing.assert_array_equal(
+            out[:, i], marginal_distribution(dist, t_out)
+        )
+    # blockwise over the addresses, with transform and dtype
+    amps = rng.normal(size=dist.shape) + 1j * rng.normal(size=dist.shape)
+    ref = address_data_marginals(np.abs(amps)**2, nq_addr, nq_data)
+    for chunk_size in (1, 3, 8):
+        out = address_data_marginals(amps, nq_addr, nq_data,
+                                     chunk_size=chunk_size,
+                                     transform=lambda x: np.abs(x)**2,
+                                     dtype=np.float32)
+        assert out.dtype == np.float32
+        np.testing.assert_allclose(out, ref, rtol=1e-5)
+
+
+def test_gather_bits():
+    bits = [0, 2, 3]
+    ref = [get_bits(i, bits) for i in range(32)]
+    np.testing.assert_array_equal(gather_bits(np.arange(32), bits), ref)
+    table = gather_bits_table(5, bits)
+    np.testing.assert_array_equal(table, ref)
+    assert gather_bits_table(5, tuple(bits)) is table